@@ -4,6 +4,7 @@ utitlity for all the apps
 from django.utils import timezone
 from django.conf import settings
 from oauth2_provider.models import Application, AccessToken, RefreshToken
+from bookstore.core.cache import cache
 from oauthlib.oauth2.rfc6749.tokens import random_token_generator
 class RegistrationStep(object):
     ''' RegistrationStep '''
@@ -31,7 +32,11 @@ class UserAccessToken(object):
         Create Outh token by user_id and application name
         '''
         scopes = 'read write'
-        application = Application.objects.get(name=self.app_name)
+        application = cache.get_or_compute(
+            'oauth:application:%s' % self.app_name,
+            lambda: Application.objects.filter(name=self.app_name).first())
+        if application is None:
+            raise Application.DoesNotExist
         expires = timezone.now() + timezone.timedelta(days=settings.USER_TOKEN_EXPIRES)
         access_token = AccessToken.objects.create(
             user=self.user,
@@ -0,0 +1,227 @@
+'''
+Two tier cache.
+
+L1 is a small LRU dictionary with a TTL in each process, L2 is the shared
+Django cache backend (CACHES), so a value computed by one worker is
+reused by all of them and hot keys are served without a network or disk
+round trip.
+
+`get_or_compute` protects expensive values from stampedes: entries carry
+a soft expiry before their hard L2 timeout, and once it passes a single
+worker (holding a short L2 lock taken with `add`) recomputes the value
+while the others keep serving the previous one. On a cold miss the other
+workers wait for that computation instead of repeating it.
+
+Entries can be tagged; `invalidate_tags` bumps the tag versions kept in
+L2 so every entry written under an older version becomes a miss. The
+invalidating process drops its L1 at once, other processes' L1 copies
+live at most CACHE_L1_TIMEOUT seconds.
+'''
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+MISSING = object()
+
+
+class LRUCache(object):
+    '''
+    Thread safe LRU dictionary whose entries expire after a TTL
+    '''
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self.lock:
+            self.entries[key] = (value, time.time() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TwoTierCache(object):
+    '''
+    Per process LRU (L1) in front of a shared Django cache backend (L2)
+    '''
+    # L1 entries hold the bare value, L2 entries are
+    # (value, soft expiry timestamp, {tag: version})
+    lock_stripes = 64
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.l1 = LRUCache(settings.CACHE_L1_MAX_ENTRIES, settings.CACHE_L1_TIMEOUT)
+        self.lock_timeout = settings.CACHE_LOCK_TIMEOUT
+        self.poll_interval = 0.05
+        self.local_locks = [threading.Lock() for _ in range(self.lock_stripes)]
+        self.stats_lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('l1_hits', 'l2_hits', 'misses', 'computed', 'stale_served', 'lock_waits'), 0)
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def count(self, counter):
+        with self.stats_lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        ''' Counters of this process plus the L1 hit rate '''
+        with self.stats_lock:
+            stats = dict(self.counters)
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['l1_hits'] + stats['l2_hits']) / lookups if lookups else 0
+        stats['l1_entries'] = len(self.l1)
+        return stats
+
+    @staticmethod
+    def tag_key(tag):
+        return 'cache-tag:%s' % tag
+
+    def tag_versions(self, tags):
+        if not tags:
+            return {}
+        keys = dict((self.tag_key(tag), tag) for tag in tags)
+        stored = self.backend.get_many(list(keys))
+        return dict((tag, stored.get(key, 0)) for key, tag in keys.items())
+
+    def invalidate_tags(self, *tags):
+        ''' Make every entry tagged with one of `tags` a miss '''
+        for tag in tags:
+            key = self.tag_key(tag)
+            if not self.backend.add(key, 1, None):
+                try:
+                    self.backend.incr(key)
+                except ValueError:
+                    self.backend.set(key, 1, None)
+        self.l1.clear()
+
+    def read(self, key):
+        '''
+        (value, soft expired) from L1 or L2, value MISSING when absent
+        or written under an outdated tag version
+        '''
+        value = self.l1.get(key)
+        if value is not MISSING:
+            self.count('l1_hits')
+            return value, False
+        entry = self.backend.get(key)
+        if entry is None:
+            self.count('misses')
+            return MISSING, False
+        value, soft_expires, tags = entry
+        if tags and self.tag_versions(tags) != tags:
+            self.count('misses')
+            return MISSING, False
+        self.count('l2_hits')
+        expired = soft_expires < time.time()
+        if not expired:
+            self.l1.set(key, value, soft_expires - time.time())
+        return value, expired
+
+    def get(self, key, default=None):
+        value, expired = self.read(key)
+        return default if value is MISSING else value
+
+    def set(self, key, value, timeout=None, tags=()):
+        '''
+        Store `value` for `timeout` seconds (the backend default when None).
+        The L2 copy outlives the timeout by CACHE_STALE_GRACE seconds so
+        get_or_compute can serve it while one worker refreshes it.
+        '''
+        if timeout is None:
+            timeout = self.backend.default_timeout
+        self.backend.set(key, (value, time.time() + timeout, self.tag_versions(tags)),
+                         timeout + settings.CACHE_STALE_GRACE)
+        self.l1.set(key, value, timeout)
+
+    def delete(self, key):
+        self.backend.delete(key)
+        self.l1.delete(key)
+
+    def local_lock(self, key):
+        return self.local_locks[zlib.crc32(key.encode('utf-8')) % self.lock_stripes]
+
+    def compute(self, key, compute, timeout, tags):
+        value = compute()
+        self.count('computed')
+        if value is not None:
+            self.set(key, value, timeout, tags)
+        return value
+
+    def get_or_compute(self, key, compute, timeout=None, tags=()):
+        '''
+        Cached value of `key`, calling `compute()` at most once across
+        all workers when it is missing or expired. A None result is
+        returned but never cached.
+        '''
+        value, expired = self.read(key)
+        if value is not MISSING and not expired:
+            return value
+        lock_key = 'cache-lock:%s' % key
+        local_lock = self.local_lock(key)
+        # with a stale value at hand never queue behind another thread
+        if not local_lock.acquire(value is MISSING):
+            self.count('stale_served')
+            return value
+        try:
+            fresh, fresh_expired = self.read(key)
+            if fresh is not MISSING and not fresh_expired:
+                return fresh
+            if self.backend.add(lock_key, 1, self.lock_timeout):
+                try:
+                    return self.compute(key, compute, timeout, tags)
+                finally:
+                    self.backend.delete(lock_key)
+        finally:
+            local_lock.release()
+        if value is not MISSING:
+            # another worker is refreshing it
+            self.count('stale_served')
+            return value
+        self.count('lock_waits')
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            if self.backend.get(lock_key) is None:
+                break
+        value, expired = self.read(key)
+        if value is not MISSING:
+            return value
+        # the other worker failed or timed out
+        return self.compute(key, compute, timeout, tags)
+
+
+cache = TwoTierCache()
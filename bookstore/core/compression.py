@@ -0,0 +1,172 @@
+'''
+Response compression.
+
+CompressionMiddleware encodes responses with brotli (when the `brotli`
+package is installed) or gzip, whichever the client accepts with the
+higher quality, brotli winning ties. Small bodies and media that is
+already compressed are sent as is; streaming responses are compressed
+chunk by chunk. Bytes in and out and the CPU time spent are counted per
+URL name so COMPRESSION_GZIP_LEVEL and COMPRESSION_BROTLI_LEVEL can be
+tuned from real traffic (see the compression-stats API); requests that
+resolve to no URL share a single entry.
+'''
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPT_ENCODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+# statistics key of requests without a URL name (404s, scanners)
+UNRESOLVED = '<unresolved>'
+
+
+class CompressionStats(object):
+    '''
+    Per process byte and CPU counters by endpoint and encoding
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(lambda: {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu': 0.0})
+
+    def add(self, endpoint, encoding, bytes_in, bytes_out, cpu, responses=1):
+        with self.lock:
+            stats = self.endpoints[(endpoint, encoding)]
+            stats['responses'] += responses
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['cpu'] += cpu
+
+    def report(self):
+        report = {}
+        with self.lock:
+            for (endpoint, encoding), stats in self.endpoints.items():
+                report.setdefault(endpoint, {})[encoding] = dict(
+                    stats,
+                    ratio=stats['bytes_in'] / stats['bytes_out'] if stats['bytes_out'] else 0,
+                    cpu_ms_per_response=1000 * stats['cpu'] / stats['responses'] if stats['responses'] else 0,
+                    cpu_ms_per_mb=1e9 * stats['cpu'] / stats['bytes_in'] if stats['bytes_in'] else 0)
+        return report
+
+
+compression_stats = CompressionStats()
+
+
+def accepted_encodings(header):
+    ''' {encoding: quality} of an Accept-Encoding header '''
+    encodings = {}
+    for item in header.split(','):
+        match = ACCEPT_ENCODING_RE.match(item)
+        if match:
+            try:
+                quality = float(match.group(2)) if match.group(2) else 1.0
+            except ValueError:
+                continue
+            encodings[match.group(1).lower()] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    ''' 'br', 'gzip' or None for an Accept-Encoding header '''
+    accepted = accepted_encodings(header or '')
+    wildcard = accepted.get('*', 0)
+    candidates = [('br', 1), ('gzip', 0)] if brotli is not None else [('gzip', 0)]
+    best = max(((accepted.get(name, wildcard), preference, name) for name, preference in candidates))
+    return best[2] if best[0] > 0 else None
+
+
+def compressor(encoding):
+    '''
+    (compress, flush, finish) callables of a fresh incremental encoder
+    '''
+    if encoding == 'br':
+        encoder = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_LEVEL)
+        return encoder.process, encoder.flush, encoder.finish
+    # wbits 31: gzip header and trailer
+    encoder = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return encoder.compress, lambda: encoder.flush(zlib.Z_SYNC_FLUSH), encoder.flush
+
+
+def compress_bytes(encoding, content):
+    compress, flush, finish = compressor(encoding)
+    return compress(content) + finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    '''
+    gzip/brotli response compression with per endpoint statistics
+    '''
+
+    def skip(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code == 206:
+            return True
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if any(content_type.startswith(prefix) for prefix in settings.COMPRESSION_SKIP_TYPES):
+            return True
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return True
+        return False
+
+    @staticmethod
+    def endpoint(request):
+        match = getattr(request, 'resolver_match', None)
+        return match.view_name if match and match.view_name else UNRESOLVED
+
+    def compress_stream(self, encoding, endpoint, content):
+        compress, flush, finish = compressor(encoding)
+        bytes_in = bytes_out = 0
+        cpu = 0.0
+        for chunk in content:
+            started = time.process_time()
+            data = compress(chunk)
+            # flush every chunk so streamed rows reach the client promptly
+            data += flush()
+            cpu += time.process_time() - started
+            bytes_in += len(chunk)
+            bytes_out += len(data)
+            if data:
+                yield data
+        started = time.process_time()
+        data = finish()
+        cpu += time.process_time() - started
+        compression_stats.add(endpoint, encoding, bytes_in, bytes_out + len(data), cpu)
+        yield data
+
+    def process_response(self, request, response):
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if self.skip(request, response):
+            return response
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+
+        endpoint = self.endpoint(request)
+        if response.streaming:
+            response.streaming_content = self.compress_stream(encoding, endpoint, response.streaming_content)
+            del response['Content-Length']
+        else:
+            started = time.process_time()
+            compressed = compress_bytes(encoding, response.content)
+            cpu = time.process_time() - started
+            compression_stats.add(endpoint, encoding, len(response.content), len(compressed), cpu)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            # the compressed body is no longer byte for byte the tagged one
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,67 @@
+'''
+Conditional GET and Cache-Control for class based views
+'''
+from calendar import timegm
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin(object):
+    '''
+    Answer GET requests with 304 Not Modified when the client's
+    If-None-Match / If-Modified-Since match `get_validators()`, which
+    should be cheap (a values_list query, not the full rows). The check
+    runs in `get`, so DRF views authenticate the request first.
+    '''
+    # patch_cache_control arguments for successful and 304 responses
+    cache_control = {}
+
+    def get_validators(self):
+        ''' (etag, last modified datetime) of the resource, either may be None '''
+        return None, None
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        etag = quote_etag(etag) if etag else None
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super(ConditionalGetMixin, self).get(request, *args, **kwargs)
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            if etag and not response.has_header('ETag'):
+                response['ETag'] = etag
+            if timestamp and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(timestamp)
+            if self.cache_control:
+                patch_cache_control(response, **self.cache_control)
+        return response
+
+
+class PageCacheControlMixin(object):
+    '''
+    Cache-Control for web pages: public for WEB_PAGE_MAX_AGE seconds to
+    anonymous visitors, private and always revalidated for signed in
+    users and for pages carrying a CSRF token
+    '''
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super(PageCacheControlMixin, self).dispatch(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            if getattr(response, 'is_rendered', True):
+                self.patch_cache_headers(request, response)
+            else:
+                # CSRF token use is only known once the template is rendered
+                response.add_post_render_callback(lambda rendered: self.patch_cache_headers(request, rendered))
+        return response
+
+    @staticmethod
+    def patch_cache_headers(request, response):
+        if response.status_code not in (200, 304) or response.has_header('Cache-Control'):
+            return
+        if request.user.is_authenticated or request.META.get('CSRF_COOKIE_USED'):
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, max_age=settings.WEB_PAGE_MAX_AGE)
+        patch_vary_headers(response, ('Cookie',))
@@ -1,5 +1,10 @@
-from catalog.models import Book
+from django.utils.functional import SimpleLazyObject
 
-def latest_books(self):
-    latest = Book.objects.all().order_by('-added_date')[:8]
-    return {'latest': latest}
+from catalog.arrivals import latest_books as get_latest_books
+
+def latest_books(request):
+    '''
+    Newest books for the footer; only fetched (from the cache) when a
+    template iterates them
+    '''
+    return {'latest': SimpleLazyObject(get_latest_books)}
@@ -0,0 +1,173 @@
+'''
+Eager loading and field projection driven by serializers.
+
+A serializer lists the relations it reads in `Meta.select_related` and
+`Meta.prefetch_related`. Nested serializers contribute their own lookups
+under the nested field's source (through a prefetch when the nested field
+is `many`), so `eager_load` applies the whole tree and serializing a page
+costs the same number of queries whatever its size.
+
+Serializers using SparseFieldsMixin also honour the `fields` query
+parameter. `eager_load` then only joins the relations the
+remaining fields read and, when every field maps to a model column,
+restricts the query to those columns with `.only()`, so large columns
+such as descriptions are not read unless asked for.
+'''
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+def unique(lookups):
+    seen = set()
+    return [lookup for lookup in lookups if not (lookup in seen or seen.add(lookup))]
+
+
+def parse_selection(value):
+    '''
+    {path: names} of a comma separated list of dotted field names,
+    e.g. 'id,book.title' -> {(): {'id', 'book'}, ('book',): {'title'}}
+    '''
+    selection = {}
+    for item in (value or '').split(','):
+        parts = tuple(part for part in item.strip().split('.') if part)
+        for depth in range(len(parts)):
+            selection.setdefault(parts[:depth], set()).add(parts[depth])
+    return selection
+
+
+class SparseFieldsMixin(object):
+    '''
+    Serializer mixin trimming its fields to the `fields` query parameter
+    of GET requests (`fields=id,title,book.title`). Unknown names are
+    ignored, so a parameter naming none of the fields keeps them all.
+    '''
+
+    def field_path(self):
+        ''' Names of the fields leading from the root serializer to this one '''
+        path = []
+        field = self
+        while field.parent is not None:
+            if field.field_name:
+                path.append(field.field_name)
+            field = field.parent
+        return tuple(reversed(path))
+
+    def get_fields(self):
+        fields = super(SparseFieldsMixin, self).get_fields()
+        request = self.context.get('request')
+        if request is not None and request.method == 'GET':
+            requested = parse_selection(request.query_params.get('fields')).get(self.field_path())
+            if requested and requested & set(fields):
+                for name in list(fields):
+                    if name not in requested:
+                        del fields[name]
+        return fields
+
+
+def model_lookup(model, source):
+    '''
+    ORM lookup of a dotted serializer field source on `model`, '' for a
+    many valued relation and None when the source is not a model field
+    '''
+    names = []
+    for part in source.split('.'):
+        if model is None:
+            return None
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            # foreign key column, e.g. book_id
+            field = next((field for field in model._meta.concrete_fields if field.attname == part), None)
+            if field is None:
+                return None
+            names.append(field.name)
+            model = None
+            continue
+        if field.many_to_many or field.one_to_many:
+            return ''
+        names.append(field.name)
+        model = field.related_model if field.is_relation else None
+    return '__'.join(names)
+
+
+def query_plan(serializer):
+    '''
+    (select_related, prefetch_related, only) lookups for the fields
+    `serializer` outputs; `only` is None when some field cannot be
+    mapped to model columns
+    '''
+    meta = getattr(serializer, 'Meta', None)
+    model = getattr(meta, 'model', None)
+    select, prefetch, columns = [], [], []
+    roots = set()
+    projectable = model is not None
+    for field in serializer.fields.values():
+        if field.source == '*':
+            projectable = False
+            continue
+        roots.add(field.source.split('.')[0])
+        many = isinstance(field, ListSerializer)
+        nested = field.child if many else field
+        lookup = field.source.replace('.', '__')
+        if isinstance(nested, BaseSerializer):
+            nested_select, nested_prefetch, nested_columns = query_plan(nested)
+            nested_select = [lookup + '__' + name for name in nested_select]
+            nested_prefetch = [lookup + '__' + name for name in nested_prefetch]
+            if many:
+                # rows reached through a prefetch can only be prefetched
+                prefetch += nested_select + nested_prefetch
+                continue
+            select += nested_select
+            prefetch += nested_prefetch
+            if nested_columns is None:
+                projectable = False
+            else:
+                columns += [lookup] + [lookup + '__' + name for name in nested_columns]
+            continue
+        column = model_lookup(model, field.source) if model is not None else None
+        if column is None:
+            projectable = False
+        elif column:
+            columns.append(column)
+
+    # declared lookups only when a remaining field reads the relation
+    select = [lookup for lookup in getattr(meta, 'select_related', ())
+              if lookup.split('__')[0] in roots] + select
+    prefetch = [lookup for lookup in getattr(meta, 'prefetch_related', ())
+                if lookup.split('__')[0] in roots] + prefetch
+    return unique(select), unique(prefetch), unique(columns) if projectable else None
+
+
+def eager_load(queryset, serializer, columns=()):
+    '''
+    `queryset` with what `serializer` (a class or an instance) reads
+    loaded up front, plus model `columns` the caller needs itself
+    '''
+    if isinstance(serializer, type):
+        serializer = serializer(context={})
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    select, prefetch, only = query_plan(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if only is not None:
+        queryset = queryset.only(*unique(only + list(columns)))
+    return queryset
+
+
+class EagerLoadingMixin(object):
+    '''
+    Generic API view mixin applying the serializer's eager loading and
+    field projection to the queryset, whatever `get_queryset` returns
+    '''
+
+    def filter_queryset(self, queryset):
+        queryset = super(EagerLoadingMixin, self).filter_queryset(queryset)
+        # keyset pagination reads the sort fields of the page bounds
+        opts = queryset.model._meta
+        names = set(field.name for field in opts.concrete_fields)
+        columns = [name.lstrip('-') for name in getattr(self, 'keyset_ordering', ())
+                   if name.lstrip('-') in names]
+        return eager_load(queryset, self.get_serializer(), columns)
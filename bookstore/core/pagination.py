@@ -0,0 +1,140 @@
+'''
+Pagination
+'''
+import datetime
+import decimal
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Keyset (seek) pagination.
+
+    Pages are addressed by an opaque signed cursor holding the sort key of
+    the last row seen, so every page is a single indexed
+    `WHERE key > cursor ORDER BY key LIMIT n` query: no COUNT and no OFFSET.
+    The sort order comes from `keyset_ordering` on the view and must end
+    with a unique field (normally `id`) so the keys are totally ordered.
+
+    A view that can seek without the database (e.g. from an in-memory
+    index) may define `keyset_seek(queryset, position, reverse, limit)`
+    returning the rows after `position` in traversal order, or None to
+    fall back to the query.
+    '''
+    page_size = settings.GET_CATEGORY_API_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, view):
+        ''' Sort fields for the view, e.g. ('title', 'id') '''
+        return tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+
+    def get_salt(self):
+        return 'keyset:%s' % ','.join(self.ordering_fields)
+
+    def encode_cursor(self, position, reverse):
+        ''' Opaque signed cursor for a sort key position '''
+        return signing.dumps({'p': [self.to_json(value) for value in position], 'r': reverse},
+                             salt=self.get_salt(), compress=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = signing.loads(encoded, salt=self.get_salt())
+        except signing.BadSignature:
+            raise NotFound(self.invalid_cursor_message)
+        position = cursor.get('p')
+        if not isinstance(position, list) or len(position) != len(self.ordering_fields):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(cursor.get('r'))
+
+    @staticmethod
+    def to_json(value):
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        return value
+
+    @staticmethod
+    def field_name(field):
+        return field.lstrip('-')
+
+    def seek_filter(self, position, reverse):
+        '''
+        Rows strictly after `position` in the (possibly reversed) sort
+        order: (a > x) OR (a = x AND b > y) OR ...
+        '''
+        query = Q()
+        equal = {}
+        for field, value in zip(self.ordering_fields, position):
+            descending = field.startswith('-') != reverse
+            name = self.field_name(field)
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            query |= Q(**dict(equal, **{lookup: value}))
+            equal[name] = value
+        return query
+
+    def position_of(self, instance):
+        return [getattr(instance, self.field_name(field)) for field in self.ordering_fields]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering_fields = self.get_ordering(view)
+        position, reverse = self.decode_cursor(request)
+
+        results = None
+        if hasattr(view, 'keyset_seek'):
+            results = view.keyset_seek(queryset, position, reverse, self.page_size + 1)
+        if results is None:
+            ordering = self.ordering_fields
+            if reverse:
+                ordering = [field[1:] if field.startswith('-') else '-' + field for field in ordering]
+            queryset = queryset.order_by(*ordering)
+            if position is not None:
+                queryset = queryset.filter(self.seek_filter(position, reverse))
+            results = list(queryset[:self.page_size + 1])
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(self.position_of(self.page[-1]), False)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        url = self.request.build_absolute_uri()
+        if not self.page:
+            return remove_query_param(url, self.cursor_query_param)
+        cursor = self.encode_cursor(self.position_of(self.page[0]), True)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
@@ -2,6 +2,8 @@
 Renderers
 '''
 import json
+from collections.abc import Iterator
+from itertools import islice
 from rest_framework.renderers import JSONRenderer
 from rest_framework.compat import (INDENT_SEPARATORS,
                                    LONG_SEPARATORS,
@@ -10,11 +12,23 @@ from rest_framework import status
 from django.utils import six
 from django.conf import settings
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class ApiRenderer(JSONRenderer):
     '''
     Api Renderer
+
+    Successful responses are written with orjson, when it is installed,
+    straight into the envelope bytes; everything else (and any payload
+    orjson cannot encode) goes through json.dumps as before.
     '''
+    fast_path = True
+    # list payloads are encoded this many items at a time
+    chunk_size = 500
 
     def check_status(self, data, api_status):
         '''
@@ -56,6 +70,52 @@ class ApiRenderer(JSONRenderer):
         data['status'] = status.HTTP_200_OK
         return data
 
+    def can_render_fast(self, indent):
+        '''
+        Whether orjson output matches json.dumps for these options
+        (compact separators, no indent, unicode kept as is)
+        '''
+        return (self.fast_path and orjson is not None and indent is None
+                and self.compact and not self.ensure_ascii)
+
+    def dumps(self, data):
+        '''
+        Compact UTF-8 JSON of `data`, with orjson when installed. Dates
+        and times are left to the DRF encoder so they are formatted the
+        same way.
+        '''
+        if orjson is None:
+            return json.dumps(data, cls=self.encoder_class, ensure_ascii=self.ensure_ascii,
+                              separators=SHORT_SEPARATORS).encode('utf-8')
+        return orjson.dumps(data, default=self.encoder_class().default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+    @staticmethod
+    def escape_separators(chunk):
+        ''' Escape U+2028 and U+2029, which are not valid inside JavaScript strings '''
+        if b'\xe2\x80' in chunk:
+            chunk = chunk.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return chunk
+
+    def render_chunks(self, data):
+        '''
+        Success envelope of `data` as a sequence of byte strings. The payload is never copied into an envelope dict;
+        list and iterator payloads are encoded `chunk_size` items at a time.
+        '''
+        yield b'{"response":'
+        if isinstance(data, (list, tuple, Iterator)):
+            items = iter(data)
+            separator = b'['
+            chunk = list(islice(items, self.chunk_size))
+            while chunk:
+                yield separator + self.escape_separators(self.dumps(chunk)[1:-1])
+                separator = b','
+                chunk = list(islice(items, self.chunk_size))
+            yield b'[]' if separator == b'[' else b']'
+        else:
+            yield self.escape_separators(self.dumps(data))
+        yield b',"status":%d}' % status.HTTP_200_OK
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
         """
         Render `data` into JSON, returning a bytestring.
@@ -74,6 +134,15 @@ class ApiRenderer(JSONRenderer):
         status_code = renderer_context['response'].status_code
         renderer_context['response'].status_code = status.HTTP_200_OK
 
+        if (status_code in [status.HTTP_200_OK, status.HTTP_201_CREATED]
+                and self.can_render_fast(indent)
+                and (isinstance(data, Iterator) or 'message' not in data)):
+            try:
+                return b''.join(self.render_chunks(data))
+            except TypeError:
+                # not encodable by orjson, let json.dumps handle or report it
+                pass
+
         if status_code in [status.HTTP_200_OK, status.HTTP_201_CREATED]:
             data = self.check_200_201(data)
 
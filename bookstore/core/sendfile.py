@@ -0,0 +1,32 @@
+'''
+Zero-copy file responses.
+
+With SENDFILE_BACKEND = 'nginx' the response only carries an
+X-Accel-Redirect to SENDFILE_URL (an `internal` nginx location aliased to
+SENDFILE_ROOT), with 'xsendfile' an X-Sendfile header for Apache or
+lighttpd, so the web server streams the file itself. Without a backend a
+FileResponse is returned, which WSGI servers providing
+`wsgi.file_wrapper` (gunicorn, uWSGI) send with sendfile(2).
+'''
+import os
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import urlquote
+
+
+def sendfile_response(path, content_type, size=None):
+    ''' Response sending the file at `path` without reading it in Python '''
+    backend = settings.SENDFILE_BACKEND
+    if backend == 'nginx':
+        response = HttpResponse(content_type=content_type)
+        relative = os.path.relpath(path, settings.SENDFILE_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = settings.SENDFILE_URL + urlquote(relative)
+        return response
+    if backend == 'xsendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Content-Length'] = str(os.path.getsize(path) if size is None else size)
+    return response
@@ -0,0 +1,102 @@
+'''
+Content addressed file storage.
+
+ContentAddressedStorage names every file it saves after the SHA-256 of
+its bytes (`books/3f/3f9a...e1.jpg` for an upload to `books/`), so the
+same image uploaded for several editions is stored once, names never
+collide and a URL always serves the same bytes. Those URLs can be cached
+forever: `serve` (the development media view) sends them with
+IMMUTABLE_MEDIA_MAX_AGE and `immutable`, production web servers should
+do the same for paths matching CONTENT_ADDRESSED_RE.
+'''
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.cache import patch_cache_control
+from django.utils.deconstruct import deconstructible
+from django.views import static
+
+CONTENT_ADDRESSED_RE = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}\.\w+$')
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED_RE.search(name.replace('\\', '/')))
+
+
+def content_hash(content):
+    ''' SHA-256 hex digest of a File, read chunk by chunk '''
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    File system storage naming files by the hash of their content and
+    never writing the same bytes twice
+    '''
+
+    def hashed_name(self, name, content):
+        ''' `dir/ab/abcdef....ext` for a file saved as `dir/name.ext` '''
+        directory, filename = os.path.split(name)
+        digest = content_hash(content)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return super(ContentAddressedStorage, self).save(self.hashed_name(name, content), content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # an existing file of that name holds the very same bytes
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+            if self.directory_permissions_mode is not None:
+                os.chmod(directory, self.directory_permissions_mode)
+        # written aside and renamed into place: a concurrent upload of the
+        # same bytes replaces it with an identical file
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+cover_storage = ContentAddressedStorage()
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    '''
+    django.views.static.serve sending content addressed files with
+    far-future cache headers
+    '''
+    response = static.serve(request, path, document_root, show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=settings.IMMUTABLE_MEDIA_MAX_AGE, immutable=True)
+    return response
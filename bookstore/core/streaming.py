@@ -0,0 +1,58 @@
+'''
+Streaming JSON exports.
+
+Rows are read through a server-side cursor (`QuerySet.iterator()`),
+their prefetches run one chunk of rows at a time, and each row is
+serialized and written as soon as it is read, inside the usual
+ApiRenderer envelope. Memory use is bounded by EXPORT_CHUNK_SIZE rather
+than by the size of the table.
+'''
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+
+from bookstore.core.eager import query_plan
+from bookstore.core.renderers import ApiRenderer
+
+
+def iter_chunks(iterable, size):
+    ''' Lists of up to `size` consecutive items of `iterable` '''
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def stream_rows(queryset, serializer, chunk_size=None):
+    '''
+    `serializer` representations of the rows of `queryset`, fetched
+    and prefetched `chunk_size` rows at a time
+    '''
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    select, prefetch, only = query_plan(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if only is not None:
+        queryset = queryset.only(*only)
+    # iterator() ignores prefetch_related, so prefetch per chunk instead
+    for chunk in iter_chunks(queryset.iterator(), chunk_size):
+        if prefetch:
+            prefetch_related_objects(chunk, *prefetch)
+        for instance in chunk:
+            yield serializer.to_representation(instance)
+
+
+class StreamingExportMixin(object):
+    '''
+    Generic API view mixin streaming every row of `get_queryset()`,
+    in primary key order, as a JSON list response
+    '''
+    renderer = ApiRenderer
+
+    def get(self, request, *args, **kwargs):
+        rows = stream_rows(self.get_queryset().order_by('pk'), self.get_serializer())
+        return StreamingHttpResponse(self.renderer().render_chunks(rows),
+                                     content_type=self.renderer.media_type)
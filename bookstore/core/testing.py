@@ -0,0 +1,23 @@
+'''
+Test helpers
+'''
+from contextlib import contextmanager
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+    '''
+    TestCase mixin failing a test when a block runs more queries than
+    its budget, listing the SQL that was executed
+    '''
+
+    @contextmanager
+    def assertQueryBudget(self, budget, using='default'):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        if len(context) > budget:
+            queries = '\n'.join('%d. %s' % (number, query['sql'])
+                                for number, query in enumerate(context.captured_queries, 1))
+            self.fail('%d queries executed, the budget is %d:\n%s' % (len(context), budget, queries))
@@ -45,7 +45,7 @@ DJANGO_APPS = [
 LOCAL_APPS = [
     'app',
     'accounts',
-    'catalog'
+    'catalog.apps.CatalogConfig'
 ]
 
 
@@ -64,6 +64,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APP + LOCAL_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'bookstore.core.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -122,6 +123,25 @@ DATABASES = {
     }
 }
 
+# Shared (L2) cache of bookstore.core.cache. Use memcached in production, e.g.
+# 'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+# 'LOCATION': '127.0.0.1:11211'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'TIMEOUT': 60 * 60,
+    }
+}
+# Entries kept in the per process (L1) cache
+CACHE_L1_MAX_ENTRIES = 1024
+# Seconds an L1 entry may lag behind L2
+CACHE_L1_TIMEOUT = 5
+# Seconds a worker may hold the recompute lock of a key
+CACHE_LOCK_TIMEOUT = 10
+# Seconds an expired entry is still served while it is being recomputed
+CACHE_STALE_GRACE = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -147,6 +167,91 @@ AUTH_PASSWORD_VALIDATORS = [
 
 GET_CATEGORY_API_PAGE_SIZE = 10
 
+REVIEWS_PAGE_SIZE = 10
+
+# dotted path of the catalog search backend, None picks one for the database engine
+CATALOG_SEARCH_BACKEND = None
+
+# text search configuration used by the PostgreSQL search backend (and by
+# migration 0029 for the initial index); run rebuild_search_index after changing it
+CATALOG_SEARCH_CONFIG = 'english'
+
+# typo tolerant search: minimum share of the query's trigrams a name must contain
+CATALOG_FUZZY_THRESHOLD = 0.4
+
+# most fuzzy matches returned per query
+CATALOG_FUZZY_LIMIT = 50
+
+# the web search falls back to fuzzy matching below this many exact hits
+CATALOG_FUZZY_MIN_HITS = 3
+
+# seconds before a process rebuilds its trigram index (0 never rebuilds)
+CATALOG_FUZZY_INDEX_TTL = 3600
+
+# completions returned by the autocomplete API by default and at most
+CATALOG_AUTOCOMPLETE_LIMIT = 8
+CATALOG_AUTOCOMPLETE_MAX_LIMIT = 25
+
+# seconds before a process rebuilds its autocomplete index in the background
+# (0 only after catalog edits)
+CATALOG_AUTOCOMPLETE_INDEX_TTL = 3600
+
+# serve the book-filters API from the in-memory filter index
+CATALOG_FILTER_INDEX = True
+
+# lower edges of the price histogram buckets, the last bucket is open ended
+CATALOG_PRICE_BUCKETS = (0, 100, 200, 300, 400, 500, 750, 1000, 1500, 2000)
+
+# seconds before a process rebuilds its filter index even though the catalog
+# version did not change (0: only on version changes)
+CATALOG_FILTER_INDEX_TTL = 3600
+
+# seconds a cached catalog API response is kept (entries are versioned, never stale)
+CATALOG_RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# newest books listed in the footer, and seconds the list stays cached
+LATEST_BOOKS_COUNT = 8
+LATEST_BOOKS_TIMEOUT = 60 * 60
+
+# seconds a rendered book card or rating block is cached (keyed by Book.last_modified)
+CATALOG_FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# book cover renditions as name: (width, height), made in the background by
+# CATALOG_IMAGE_WORKERS threads (0 makes them inline) as JPEG and WebP
+CATALOG_IMAGE_RENDITIONS = {
+    'thumbnail': (100, 150),
+    'card': (200, 300),
+    'detail': (400, 600),
+}
+CATALOG_IMAGE_WORKERS = 2
+CATALOG_IMAGE_JPEG_QUALITY = 85
+CATALOG_IMAGE_WEBP_QUALITY = 80
+# seconds a rendition that does not exist yet is remembered as missing
+CATALOG_RENDITION_MISSING_TIMEOUT = 60
+
+# seconds browsers and shared caches may keep catalog pages of anonymous visitors
+WEB_PAGE_MAX_AGE = 60
+
+# take ordered quantities out of Book.stock_qty, refusing orders that exceed it
+CATALOG_TRACK_STOCK = True
+
+# seconds stock held for a checkout stays reserved
+CATALOG_STOCK_RESERVATION_TIMEOUT = 15 * 60
+
+# rows fetched, prefetched and serialized together by the streaming exports
+EXPORT_CHUNK_SIZE = 500
+
+# response compression: bodies smaller than this many bytes are sent as is
+COMPRESSION_MIN_SIZE = 512
+# zlib level 1-9 and brotli quality 0-11, trading CPU for ratio
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_LEVEL = 4
+# content types (prefixes) that are already compressed
+COMPRESSION_SKIP_TYPES = (
+    'image/', 'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip',
+    'application/x-gzip', 'application/pdf', 'application/octet-stream',
+)
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
@@ -185,6 +290,23 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'public','media')
 
 MEDIA_URL = '/media/'
 
+# on demand cover thumbnails: disk cache directory and its size in bytes (least
+# recently used files are evicted), largest width or height served, and seconds
+# browsers may keep thumbnails of covers that are not content addressed
+THUMBNAIL_CACHE_DIR = os.path.join(BASE_DIR, 'thumbnail_cache')
+THUMBNAIL_CACHE_MAX_SIZE = 512 * 1024 * 1024
+THUMBNAIL_MAX_DIMENSION = 1200
+THUMBNAIL_MAX_AGE = 7 * 24 * 60 * 60
+
+# let the web server send files: 'nginx' (X-Accel-Redirect to SENDFILE_URL, an
+# internal location aliased to SENDFILE_ROOT), 'xsendfile' or None (FileResponse)
+SENDFILE_BACKEND = None
+SENDFILE_ROOT = THUMBNAIL_CACHE_DIR
+SENDFILE_URL = '/protected/thumbnails/'
+
+# seconds browsers may cache content addressed media (book covers), whose URLs never change
+IMMUTABLE_MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+
 SESSION_COOKIE_NAME = 'bookstoreworks'
 
 GET_CATEGORY_API_PAGE_SIZE = 2
@@ -9,7 +9,7 @@ from django.contrib.flatpages.models import FlatPage
 from django.utils.translation import ugettext_lazy as _
 from app.models import EmailMessage
 
-from .models import Author, Book, Genre, Publisher, Review, Order, OrderDetail
+from .models import Author, Book, Genre, Publisher, Review, Order, OrderDetail, CatalogVersion
 
 # Register your models here.
 
@@ -50,7 +50,7 @@ class StockListFilter(SimpleListFilter):
         return result
 
 class BookAdmin(admin.ModelAdmin):
-    list_display = ['isbn', 'title', 'in_stock', 'genre', 'status', 'avg_rating']
+    list_display = ['isbn', 'title', 'in_stock', 'genre', 'status', 'avg_rating', 'rating_count']
     ordering = ['title']
     actions = ['make_published','delete_books']
     search_fields = ['title']
@@ -63,17 +63,19 @@ class BookAdmin(admin.ModelAdmin):
             'fields': ('author','publisher','publication_date','genre')
         }),        
         ('Meta Data', {
-            'fields': ('pages','price','stock_free','stock_qty','free_delivery','status', 'avg_rating')
+            'fields': ('pages','price','stock_free','stock_qty','free_delivery','status', 'avg_rating', 'rating_count')
         }),
     )
-    readonly_fields = ['avg_rating']
+    readonly_fields = ['avg_rating', 'rating_count']
 
     def make_published(self, request, queryset):
         queryset.update(status='published')
+        CatalogVersion.bump()
     make_published.short_description = "Mark selected books as published"
     
     def delete_books(self, request, queryset):
         queryset.update(is_active=False)
+        CatalogVersion.bump()
     delete_books.short_description = "Mark selected books to be deleted"
 
     def in_stock(self, obj):
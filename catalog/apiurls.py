@@ -1,14 +1,23 @@
 from django.conf.urls import url
 from .views.api import (GetCategories, GetBooks, GetBookDetail, BookSearch, 
-                        FilterList, BookFilter, OrdersDetailView, OrdersView)
+                        FilterList, BookFilter, OrdersDetailView, OrdersView, OrderHistory,
+                        StockReservationView, BookExport, OrderExport,
+                        Autocomplete, ResponseCacheStatsView, CompressionStatsView)
 
 urlpatterns = [
     url(r'^category-list/$', GetCategories.as_view(), name='category-list'),
     url(r'^book-list/$', GetBooks.as_view(), name='books-list'),
     url(r'^book-detail/$', GetBookDetail.as_view(), name='book-detail'),
     url(r'^search-books/$', BookSearch.as_view(), name='search-books'),
+    url(r'^autocomplete/$', Autocomplete.as_view(), name='autocomplete'),
     url(r'^filters/$', FilterList.as_view(), name='filters'),
     url(r'^book-filters/$', BookFilter.as_view(), name='book-filters'),
+    url(r'^export/books/$', BookExport.as_view(), name='export-books'),
+    url(r'^export/orders/$', OrderExport.as_view(), name='export-orders'),
+    url(r'^cache-stats/$', ResponseCacheStatsView.as_view(), name='cache-stats'),
+    url(r'^compression-stats/$', CompressionStatsView.as_view(), name='compression-stats'),
     url(r'^get-orders/$', OrdersView.as_view(), name='get-orders'),
+    url(r'^order-history/$', OrderHistory.as_view(), name='order-history'),
+    url(r'^stock-reservations/$', StockReservationView.as_view(), name='stock-reservations'),
     url(r'^get-order-detail/$', OrdersDetailView.as_view(), name='get-order-detail'),
 ]
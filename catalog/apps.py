@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CatalogConfig(AppConfig):
     name = 'catalog'
+
+    def ready(self):
+        # connect the signal receivers that keep the catalog indexes current
+        from catalog import search, fuzzy, autocomplete, filter_index, response_cache, arrivals, fragments, renditions
@@ -0,0 +1,31 @@
+'''
+Newest books, shown in the footer of every page.
+
+The list is kept in the two tier cache under the `latest_books` tag, which
+the receivers below invalidate whenever a book is added, edited (e.g.
+activated) or removed.
+'''
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from bookstore.core.cache import cache
+from catalog.models import Book
+
+LATEST_BOOKS_TAG = 'latest_books'
+
+
+def latest_books(limit=None):
+    ''' The `limit` most recently added books, newest first '''
+    limit = limit or settings.LATEST_BOOKS_COUNT
+    return cache.get_or_compute(
+        'catalog:latest_books:%d' % limit,
+        lambda: list(Book.objects.only('id', 'title', 'slug', 'image').order_by('-added_date')[:limit]),
+        settings.LATEST_BOOKS_TIMEOUT, tags=(LATEST_BOOKS_TAG,))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_latest_books(sender, raw=False, **kwargs):
+    if not raw:
+        cache.invalidate_tags(LATEST_BOOKS_TAG)
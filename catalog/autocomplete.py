@@ -0,0 +1,172 @@
+'''
+Prefix completion of book titles, author and publisher names.
+
+Names are normalized (unidecode, lower case) and every word start is kept
+in one sorted array, so a prefix is a bisect plus a scan of its range.
+The top completions of one and two letter prefixes, whose ranges are the
+largest, are precomputed. The index lives in process memory and is built
+on first use. Catalog signals and CATALOG_AUTOCOMPLETE_INDEX_TTL mark it
+stale; a stale index keeps answering while a single background thread
+rebuilds it, so edits never make requests wait for (or repeat) a rebuild.
+'''
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from catalog.fuzzy import normalize
+from catalog.models import Book, Author, Publisher, OrderDetail
+
+# prefixes up to this length get their completions precomputed
+SHORT_PREFIX = 2
+
+
+class PrefixIndex(object):
+    '''
+    Sorted array of (normalized key, entry number) with entries ranked
+    by popularity
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.refs = []
+        self.entries = []
+        self.short = {}
+        self.built_at = None
+        self.dirty = False
+        # held by the one thread (re)building the index
+        self.build_lock = threading.Lock()
+
+    def invalidate(self):
+        self.dirty = True
+
+    def is_stale(self):
+        ttl = settings.CATALOG_AUTOCOMPLETE_INDEX_TTL
+        return self.built_at is None or self.dirty or bool(ttl and time.time() - self.built_at > ttl)
+
+    def ensure_fresh(self):
+        '''
+        Build the index on first use (concurrent first requests wait for
+        one build), later start a background rebuild when it is stale
+        '''
+        if self.built_at is None:
+            with self.build_lock:
+                if self.built_at is None:
+                    self.build()
+        elif self.is_stale() and self.build_lock.acquire(False):
+            threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def rebuild(self):
+        ''' Background rebuild, run with build_lock held '''
+        try:
+            self.build()
+        except Exception:
+            self.dirty = True
+            raise
+        finally:
+            self.build_lock.release()
+            close_old_connections()
+
+    @staticmethod
+    def load_entries():
+        '''
+        (popularity, kind, id, name, slug) for every book, author and publisher.
+        A book is as popular as the copies sold plus its average rating,
+        authors and publishers add up their books.
+        '''
+        sold = dict(OrderDetail.objects.values_list('bk_id').annotate(Sum('qty')).order_by())
+        books = {}
+        entries = []
+        for pk, title, slug, publisher_id, rating_sum, rating_count in Book.objects.values_list(
+                'id', 'title', 'slug', 'publisher_id', 'rating_sum', 'rating_count').iterator():
+            popularity = (sold.get(pk) or 0) + (rating_sum / rating_count if rating_count else 0)
+            books[pk] = (popularity, publisher_id)
+            entries.append((popularity, 'book', pk, title, slug))
+
+        authors, publishers = defaultdict(float), defaultdict(float)
+        for book_id, author_id in Book.author.through.objects.values_list('book_id', 'author_id').iterator():
+            authors[author_id] += books.get(book_id, (0, None))[0]
+        for popularity, publisher_id in books.values():
+            publishers[publisher_id] += popularity
+        for pk, name, slug in Author.objects.values_list('id', 'name', 'slug').iterator():
+            entries.append((authors[pk], 'author', pk, name, slug))
+        for pk, name, slug in Publisher.objects.values_list('id', 'name', 'slug').iterator():
+            entries.append((publishers[pk], 'publisher', pk, name, slug))
+        return entries
+
+    def build(self):
+        # cleared first: an edit made while loading marks the new index stale
+        self.dirty = False
+        entries = self.load_entries()
+        pairs = []
+        for ref, entry in enumerate(entries):
+            words = normalize(entry[3]).split()
+            for start in range(len(words)):
+                pairs.append((' '.join(words[start:]), ref))
+        pairs.sort()
+        short = defaultdict(list)
+        limit = settings.CATALOG_AUTOCOMPLETE_LIMIT
+        for key, ref in pairs:
+            for length in range(1, SHORT_PREFIX + 1):
+                if len(key) >= length:
+                    short[key[:length]].append(ref)
+        short = dict((prefix, self.top(set(refs), entries, limit)) for prefix, refs in short.items())
+        with self.lock:
+            self.entries = entries
+            self.keys = [key for key, ref in pairs]
+            self.refs = [ref for key, ref in pairs]
+            self.short = short
+            self.built_at = time.time()
+
+    @staticmethod
+    def top(refs, entries, limit):
+        return heapq.nlargest(limit, refs, key=lambda ref: (entries[ref][0], -ref))
+
+    def complete(self, prefix, limit=None):
+        '''
+        Most popular entries with a word starting with `prefix`
+        '''
+        limit = limit or settings.CATALOG_AUTOCOMPLETE_LIMIT
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            entries = self.entries
+            if len(prefix) <= SHORT_PREFIX and limit <= settings.CATALOG_AUTOCOMPLETE_LIMIT:
+                refs = self.short.get(prefix, [])[:limit]
+            else:
+                start = bisect_left(self.keys, prefix)
+                end = bisect_left(self.keys, prefix + '\uffff', start)
+                refs = self.top(set(self.refs[start:end]), entries, limit)
+        return [entries[ref] for ref in refs]
+
+
+prefix_index = PrefixIndex()
+
+
+def complete(prefix, limit=None):
+    '''
+    [{type, id, name, slug}] completions of `prefix`
+    '''
+    prefix_index.ensure_fresh()
+    return [{'type': kind, 'id': pk, 'name': name, 'slug': slug}
+            for popularity, kind, pk, name, slug in prefix_index.complete(prefix, limit)]
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+@receiver(m2m_changed, sender=Book.author.through)
+def invalidate_prefix_index(sender, **kwargs):
+    prefix_index.invalidate()
@@ -0,0 +1,58 @@
+'''
+Validators for conditional GETs of catalog resources.
+
+Catalog listings are validated by the catalog version and the time of its
+last bump, a book by its `last_modified` column on top of that (ratings
+and reviews touch it without bumping the version). Either is read with a
+single values_list query, so answering a 304 never loads the rows.
+'''
+from django.db import models
+from django.db.models import Subquery
+
+from bookstore.core.conditional import ConditionalGetMixin
+from catalog.models import Book, CatalogVersion
+
+
+def catalog_validators():
+    ''' (etag, last modified) of the catalog as a whole '''
+    version, updated_at = CatalogVersion.state()
+    return 'catalog-%d' % version, updated_at
+
+
+def book_validators(queryset, prefix='book'):
+    ''' (etag, last modified) of the single book in `queryset`, (None, None) when absent '''
+    catalog = CatalogVersion.objects.filter(id=1)
+    book = queryset.annotate(
+        catalog_version=Subquery(catalog.values('version')[:1], output_field=models.IntegerField()),
+        catalog_updated_at=Subquery(catalog.values('updated_at')[:1], output_field=models.DateTimeField()),
+    ).values_list('id', 'last_modified', 'catalog_version', 'catalog_updated_at').first()
+    if book is None:
+        return None, None
+    book_id, modified, version, updated_at = book
+    last_modified = max(modified, updated_at) if updated_at is not None else modified
+    etag = '%s-%d-%d-catalog-%d' % (prefix, book_id, modified.timestamp() * 1000000, version or 0)
+    return etag, last_modified
+
+
+class CatalogConditionalMixin(ConditionalGetMixin):
+    '''
+    Conditional GETs of catalog wide API listings
+    '''
+    cache_control = {'private': True, 'no_cache': True}
+
+    def get_validators(self):
+        return catalog_validators()
+
+
+class BookConditionalMixin(ConditionalGetMixin):
+    '''
+    Conditional GETs of a single book API resource, `get_book_queryset`
+    filters the book
+    '''
+    cache_control = {'private': True, 'no_cache': True}
+
+    def get_book_queryset(self):
+        raise NotImplementedError
+
+    def get_validators(self):
+        return book_validators(self.get_book_queryset())
@@ -0,0 +1,54 @@
+'''
+Facet counts for the shop sidebar and the filters API.
+
+Every facet is counted with one grouped query over the books matched by
+all the *other* selected filters, so a user can see how many books each
+genre, author or publisher would add to the current selection.
+'''
+from collections import OrderedDict
+
+from django.db.models import Count
+
+from catalog.models import Book, Genre, Author, Publisher
+
+
+def count_genres(queryset):
+    return dict(queryset.order_by().values_list('genre').annotate(total=Count('id', distinct=True)))
+
+
+def count_publishers(queryset):
+    return dict(queryset.order_by().values_list('publisher').annotate(total=Count('id', distinct=True)))
+
+
+def count_authors(queryset):
+    return dict(Book.author.through.objects.filter(book__in=queryset.values('id')).order_by()
+                .values_list('author').annotate(total=Count('book', distinct=True)))
+
+
+FACETS = OrderedDict([
+    ('genre', (Genre, count_genres)),
+    ('author', (Author, count_authors)),
+    ('publisher', (Publisher, count_publishers)),
+])
+
+
+def facet_counts(queryset_without):
+    '''
+    {facet: {value id: book count}} where `queryset_without(facet)`
+    returns the books matching every selected filter except `facet`
+    '''
+    return dict((facet, counter(queryset_without(facet)))
+                for facet, (model, counter) in FACETS.items())
+
+
+def book_facets(queryset_without):
+    '''
+    {facet: [{id, name, count}]} listing every genre, author and
+    publisher by name with its book count
+    '''
+    counts = facet_counts(queryset_without)
+    facets = {}
+    for facet, (model, counter) in FACETS.items():
+        facets[facet] = [{'id': pk, 'name': name, 'count': counts[facet].get(pk, 0)}
+                         for pk, name in model.objects.order_by('name').values_list('id', 'name')]
+    return facets
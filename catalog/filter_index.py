@@ -0,0 +1,406 @@
+'''
+In-memory filter index for the book-filters API.
+
+Every genre, author, publisher and price bucket (CATALOG_PRICE_BUCKETS)
+maps to a sorted array of its book ids, so a filter request is a few
+merges and intersections (smallest array first) instead of a multi-join
+query with duplicate rows. An array costs four bytes per book whatever
+the spread of the ids, where a bitmap would cost max(book id) bits for
+every single author. Books are also kept sorted by (title, id), which lets the keyset pagination of
+BookFilter seek in memory and fetch only the page rows from the database.
+Book counts per price bucket are maintained globally and per genre, so
+the price histogram is free and price ranges on bucket edges are plain
+unions of buckets.
+
+The index lives in process memory, is built on first use and updated by
+the signal receivers at the bottom of this module. Every edit bumps the
+catalog version (see catalog.response_cache); the editing process applies
+the edit incrementally and moves its index to the new version, while any
+other process finds its index behind and rebuilds it on the next
+request, so responses cached under a new version never come from an
+outdated index. The rebuild runs once behind a lock while concurrent
+requests wait for it. CATALOG_FILTER_INDEX_TTL is only a backstop.
+'''
+import heapq
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from catalog.models import Book, Genre, Author, Publisher, CatalogVersion, catalog_version_bumped
+
+FACETS = ('genre', 'author', 'publisher')
+
+
+def id_array():
+    return array('I')
+
+
+def insert_id(ids, pk):
+    ''' Add `pk` to the sorted array `ids` '''
+    index = bisect_left(ids, pk)
+    if index == len(ids) or ids[index] != pk:
+        ids.insert(index, pk)
+
+
+def remove_id(ids, pk):
+    ''' Drop `pk` from the sorted array `ids` '''
+    index = bisect_left(ids, pk)
+    if index < len(ids) and ids[index] == pk:
+        del ids[index]
+
+
+def contains(ids, pk):
+    index = bisect_left(ids, pk)
+    return index < len(ids) and ids[index] == pk
+
+
+def union(arrays):
+    ''' Sorted array of the ids in any of the sorted `arrays` '''
+    if len(arrays) == 1:
+        return array('I', arrays[0])
+    ids = array('I')
+    for pk in heapq.merge(*arrays):
+        if not ids or ids[-1] != pk:
+            ids.append(pk)
+    return ids
+
+
+def intersect(small, large):
+    ''' Sorted array of the ids in both sorted arrays, bisecting `large` '''
+    ids = array('I')
+    index = 0
+    for pk in small:
+        index = bisect_left(large, pk, index)
+        if index == len(large):
+            break
+        if large[index] == pk:
+            ids.append(pk)
+    return ids
+
+
+class BookFilterIndex(object):
+    '''
+    Sorted arrays of book ids per facet value and price bucket
+    '''
+    # seek sorts the matches instead of walking the title order when
+    # they are fewer than this fraction of the catalog
+    sort_factor = 8
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # held for a whole build, so concurrent requests build once
+        self.build_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # facet -> value id -> sorted book ids
+        self.postings = dict((facet, defaultdict(id_array)) for facet in FACETS)
+        # facet -> value id -> name, and name -> value ids
+        self.names = dict((facet, {}) for facet in FACETS)
+        self.by_name = dict((facet, defaultdict(set)) for facet in FACETS)
+        # price bucket -> sorted book ids, and book counts per bucket for every genre
+        self.bucket_edges = tuple(settings.CATALOG_PRICE_BUCKETS)
+        self.price_buckets = defaultdict(id_array)
+        self.genre_histograms = defaultdict(lambda: [0] * len(self.bucket_edges))
+        # book id -> (title, price, genre id, publisher id, author ids)
+        self.books = {}
+        # (title, id) of every book, sorted
+        self.order = []
+        self.built_at = None
+        # catalog version the index was built at
+        self.version = None
+
+    def invalidate(self):
+        self.built_at = None
+
+    def is_stale(self, version=None):
+        '''
+        Whether the index is missing, older than its TTL or not at
+        `version` (default: the current catalog version)
+        '''
+        if self.built_at is None:
+            return True
+        if version is None:
+            version = CatalogVersion.current()
+        if self.version != version:
+            return True
+        ttl = settings.CATALOG_FILTER_INDEX_TTL
+        return bool(ttl and time.time() - self.built_at > ttl)
+
+    def build(self):
+        ''' (Re)load every book and facet value from the database '''
+        # read first: an edit made while loading leaves the index stale
+        version = CatalogVersion.current()
+        authors = defaultdict(list)
+        for book_id, author_id in Book.author.through.objects.values_list('book_id', 'author_id').iterator():
+            authors[book_id].append(author_id)
+        with self.lock:
+            self.clear()
+            for facet, model in (('genre', Genre), ('author', Author), ('publisher', Publisher)):
+                for pk, name in model.objects.values_list('id', 'name').iterator():
+                    self.set_name(facet, pk, name)
+            for pk, title, price, genre_id, publisher_id in Book.objects.values_list(
+                    'id', 'title', 'price', 'genre_id', 'publisher_id').iterator():
+                self.add_book(pk, title, price, genre_id, publisher_id, authors.get(pk, ()))
+            self.built_at = time.time()
+            self.version = version
+
+    def follow_version(self, version):
+        '''
+        Move to `version` after a bump of this process: its edit is already
+        applied. A bigger jump includes edits of other processes, so the
+        index stays behind and is rebuilt.
+        '''
+        with self.lock:
+            if self.version == version - 1:
+                self.version = version
+
+    def set_name(self, facet, pk, name):
+        with self.lock:
+            self.remove_name(facet, pk)
+            self.names[facet][pk] = name
+            self.by_name[facet][name].add(pk)
+
+    def remove_name(self, facet, pk):
+        with self.lock:
+            name = self.names[facet].pop(pk, None)
+            if name is not None:
+                self.by_name[facet][name].discard(pk)
+                if not self.by_name[facet][name]:
+                    del self.by_name[facet][name]
+
+    def add_book(self, pk, title, price, genre_id, publisher_id, author_ids):
+        with self.lock:
+            self.remove_book(pk)
+            self.books[pk] = (title, price, genre_id, publisher_id, tuple(author_ids))
+            insert_id(self.postings['genre'][genre_id], pk)
+            insert_id(self.postings['publisher'][publisher_id], pk)
+            for author_id in author_ids:
+                insert_id(self.postings['author'][author_id], pk)
+            bucket = self.bucket_of(price)
+            insert_id(self.price_buckets[bucket], pk)
+            self.genre_histograms[genre_id][bucket] += 1
+            insort(self.order, (title, pk))
+
+    def remove_book(self, pk):
+        with self.lock:
+            book = self.books.pop(pk, None)
+            if book is None:
+                return
+            title, price, genre_id, publisher_id, author_ids = book
+            remove_id(self.postings['genre'][genre_id], pk)
+            remove_id(self.postings['publisher'][publisher_id], pk)
+            for author_id in author_ids:
+                remove_id(self.postings['author'][author_id], pk)
+            bucket = self.bucket_of(price)
+            remove_id(self.price_buckets[bucket], pk)
+            self.genre_histograms[genre_id][bucket] -= 1
+            position = bisect_left(self.order, (title, pk))
+            if position < len(self.order) and self.order[position] == (title, pk):
+                del self.order[position]
+
+    def reload_books(self, book_ids):
+        ''' Refresh some books from the database '''
+        book_ids = set(book_ids)
+        authors = defaultdict(list)
+        for book_id, author_id in Book.author.through.objects.filter(
+                book_id__in=book_ids).values_list('book_id', 'author_id'):
+            authors[book_id].append(author_id)
+        rows = Book.objects.filter(id__in=book_ids).values_list(
+            'id', 'title', 'price', 'genre_id', 'publisher_id')
+        with self.lock:
+            for pk, title, price, genre_id, publisher_id in rows:
+                self.add_book(pk, title, price, genre_id, publisher_id, authors.get(pk, ()))
+                book_ids.discard(pk)
+            for pk in book_ids:
+                self.remove_book(pk)
+
+    def facet_ids(self, facet, names):
+        ''' Books having any of the facet values called `names` '''
+        postings = [self.postings[facet][pk] for name in names
+                    for pk in self.by_name[facet].get(name, ()) if pk in self.postings[facet]]
+        return union(postings)
+
+    def bucket_of(self, price):
+        ''' Index of the price bucket holding `price` '''
+        return max(bisect_right(self.bucket_edges, price) - 1, 0)
+
+    def bucket_bounds(self):
+        ''' [(start, end)] of every price bucket, end None for the last one '''
+        edges = self.bucket_edges
+        return [(edges[bucket], edges[bucket + 1] if bucket + 1 < len(edges) else None)
+                for bucket in range(len(edges))]
+
+    def price_ids(self, start, end):
+        ''' Books with start <= price < end '''
+        parts = []
+        for bucket, (low, high) in enumerate(self.bucket_bounds()):
+            if bucket == 0:
+                low = float('-inf')
+            if high is None:
+                high = float('inf')
+            if high <= start or low >= end:
+                continue
+            if start <= low and high <= end:
+                parts.append(self.price_buckets.get(bucket, ()))
+                continue
+            # bucket straddles a range edge: check the prices one by one
+            parts.append(array('I', (pk for pk in self.price_buckets.get(bucket, ())
+                                     if start <= self.books[pk][1] < end)))
+        return union(parts)
+
+    def genre_ids(self, names):
+        ''' Ids of the genres called `names` '''
+        ids = set()
+        for name in names:
+            ids |= self.by_name['genre'].get(name, set())
+        return ids
+
+    def price_histogram(self, genre_ids=None):
+        '''
+        [{start, end, count}] books per price bucket over the whole
+        catalog (`genre_ids` None) or the genres `genre_ids`
+        '''
+        with self.lock:
+            if genre_ids is None:
+                genre_ids = list(self.genre_histograms)
+            counts = [0] * len(self.bucket_edges)
+            for genre_id in genre_ids:
+                for bucket, count in enumerate(self.genre_histograms.get(genre_id, ())):
+                    counts[bucket] += count
+        return [{'start': low, 'end': high, 'count': count}
+                for (low, high), count in zip(self.bucket_bounds(), counts)]
+
+    def match(self, genres=None, authors=None, publishers=None, start=None, end=None):
+        '''
+        Sorted array of the books matching the book-filters API
+        filters, or None when nothing is filtered
+        '''
+        with self.lock:
+            selections = []
+            for facet, names in (('genre', genres), ('author', authors), ('publisher', publishers)):
+                if names:
+                    selections.append(self.facet_ids(facet, names))
+            if start is not None and start >= 0 and end is not None:
+                selections.append(self.price_ids(start, end))
+        if not selections:
+            return None
+        selections.sort(key=len)
+        ids = selections[0]
+        for other in selections[1:]:
+            ids = intersect(ids, other)
+        return ids
+
+    def seek(self, ids, position=None, reverse=False, limit=None):
+        '''
+        Up to `limit` of the sorted array `ids` (None means every book)
+        following the (title, id) `position` in title order, or preceding
+        it when `reverse`
+        '''
+        page = []
+        with self.lock:
+            order = self.order
+            if ids is not None and len(ids) * self.sort_factor < len(order):
+                # few matches: sorting them beats walking the whole catalog
+                order = sorted((self.books[pk][0], pk) for pk in ids if pk in self.books)
+                ids = None
+            if reverse:
+                index = bisect_left(order, tuple(position)) - 1 if position else len(order) - 1
+                step = -1
+            else:
+                index = bisect_right(order, tuple(position)) if position else 0
+                step = 1
+            while 0 <= index < len(order) and (limit is None or len(page) < limit):
+                pk = order[index][1]
+                if ids is None or contains(ids, pk):
+                    page.append(pk)
+                index += step
+        return page
+
+    def memory_usage(self):
+        ''' Approximate bytes held by the index, per structure '''
+        with self.lock:
+            return {
+                'postings': sum(sys.getsizeof(ids) for values in self.postings.values()
+                                for ids in values.values()),
+                'price_buckets': sum(sys.getsizeof(ids) for ids in self.price_buckets.values()),
+                'books': sys.getsizeof(self.books) +
+                         sum(sys.getsizeof(book) + sys.getsizeof(book[0]) for book in self.books.values()),
+                'order': sys.getsizeof(self.order) + sum(sys.getsizeof(key) for key in self.order),
+                'names': sum(sys.getsizeof(names) + sys.getsizeof(by_name)
+                             for names, by_name in zip(self.names.values(), self.by_name.values())),
+            }
+
+
+filter_index = BookFilterIndex()
+
+
+def get_filter_index(version=None):
+    '''
+    The process index, (re)built when missing or behind the catalog
+    `version` (default: the current one)
+    '''
+    if filter_index.is_stale(version):
+        with filter_index.build_lock:
+            # built by another thread while this one waited
+            if filter_index.is_stale(version):
+                filter_index.build()
+    return filter_index
+
+
+@receiver(post_save, sender=Book)
+def index_book_filters(sender, instance, raw=False, **kwargs):
+    if filter_index.built_at is not None:
+        filter_index.reload_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book_filters(sender, instance, **kwargs):
+    filter_index.remove_book(instance.pk)
+
+
+@receiver(m2m_changed, sender=Book.author.through)
+def index_book_author_filters(sender, instance, action, reverse, pk_set, **kwargs):
+    if filter_index.built_at is None or not action.startswith('post_'):
+        return
+    if not reverse:
+        filter_index.reload_books([instance.pk])
+    elif pk_set:
+        filter_index.reload_books(pk_set)
+    else:
+        filter_index.invalidate()
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+def index_facet_name(sender, instance, raw=False, **kwargs):
+    if filter_index.built_at is not None:
+        filter_index.set_name(sender.__name__.lower(), instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Publisher)
+def unindex_facet_name(sender, instance, **kwargs):
+    filter_index.remove_name(sender.__name__.lower(), instance.pk)
+
+
+@receiver(post_delete, sender=Author)
+def unindex_author(sender, instance, **kwargs):
+    # the author's book links are gone without m2m signals
+    filter_index.invalidate()
+
+
+@receiver(catalog_version_bumped)
+def follow_catalog_version(sender, version, **kwargs):
+    # runs after the receivers above; bumps without a model signal (admin
+    # bulk actions, migrate_covers) change no field the index holds
+    if filter_index.built_at is not None:
+        filter_index.follow_version(version)
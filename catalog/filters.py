@@ -14,3 +14,36 @@ class CatalogFilter(django_filters.FilterSet):
     class Meta(object):
         model = Book
         fields = ['genre', 'author', 'publisher', 'price']
+
+
+def parse_book_filters(query_params):
+    '''
+    Book filters from the book-filters API query string:
+    comma separated genre, author and publisher names and a price range
+    '''
+    filters = {}
+    for name in ('genres', 'authors', 'publishers'):
+        value = query_params.get(name, None)
+        filters[name] = value.split(',') if value else None
+    for name in ('start', 'end'):
+        value = query_params.get(name, None)
+        filters[name] = float(value) if value not in (None, '') else None
+    return filters
+
+
+def filter_books(queryset, genres=None, authors=None, publishers=None, start=None, end=None):
+    '''
+    Apply the book-filters API filters to a Book queryset.
+    Author names are matched through a subquery so books with several
+    matching authors are not repeated.
+    '''
+    if genres:
+        queryset = queryset.filter(genre__name__in=genres)
+    if authors:
+        queryset = queryset.filter(id__in=Book.author.through.objects.filter(
+            author__name__in=authors).values('book_id'))
+    if publishers:
+        queryset = queryset.filter(publisher__name__in=publishers)
+    if start is not None and start >= 0 and end is not None:
+        queryset = queryset.filter(price__gte=start, price__lt=end)
+    return queryset
@@ -0,0 +1,52 @@
+'''
+Cached template fragments of book pages.
+
+A fragment (a shop card, the rating block of the book page, ...) is stored
+in the two tier cache under the book id and its `last_modified`, so saving
+the book, rating or reviewing it moves it to a new key and the old entry
+simply expires. Authors, publishers and genres shown in the fragments do
+not touch the book, their receivers invalidate every fragment through the
+`book_fragments` tag instead. Only markup that is the same for every
+visitor may be cached: the review form and the user's own review stay out.
+'''
+import hashlib
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.encoding import force_text
+
+from bookstore.core.cache import cache
+from catalog.models import Book, Author, Publisher, Genre
+
+FRAGMENT_TAG = 'book_fragments'
+
+
+def fragment_key(name, book, vary_on=()):
+    ''' Cache key of fragment `name` of `book`, varying on extra values '''
+    modified = book.last_modified.timestamp() if book.last_modified else 0
+    vary = hashlib.md5(':'.join(force_text(value) for value in vary_on).encode('utf-8')).hexdigest()
+    return 'catalog:fragment:%s:%s:%d:%s' % (name, book.pk, modified * 1000000, vary)
+
+
+def cached_fragment(name, book, render, vary_on=()):
+    ''' Markup of fragment `name` of `book`, calling `render()` on a miss '''
+    return cache.get_or_compute(fragment_key(name, book, vary_on), render,
+                                settings.CATALOG_FRAGMENT_CACHE_TIMEOUT, tags=(FRAGMENT_TAG,))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Genre)
+def invalidate_fragments(sender, raw=False, **kwargs):
+    if not raw:
+        cache.invalidate_tags(FRAGMENT_TAG)
+
+
+@receiver(m2m_changed, sender=Book.author.through)
+def invalidate_fragments_m2m(sender, action, **kwargs):
+    if action.startswith('post_'):
+        cache.invalidate_tags(FRAGMENT_TAG)
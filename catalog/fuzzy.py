@@ -0,0 +1,248 @@
+'''
+Typo tolerant matching of book titles, author and publisher names.
+
+A process local trigram index answers "which names look like this text"
+without touching the database. It is built on first use, kept current by
+the signal receivers at the bottom of this module and rebuilt after
+CATALOG_FUZZY_INDEX_TTL seconds to pick up edits made by other processes.
+The rebuild runs in a single background thread while the old index keeps
+answering, and is repeated when an edit arrives during it.
+'''
+import re
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+from unidecode import unidecode
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from catalog.models import Book, Author, Publisher
+
+BOOK, AUTHOR, PUBLISHER = 'book', 'author', 'publisher'
+
+
+def normalize(text):
+    ''' Lower-case ascii words of `text` '''
+    return ' '.join(re.findall(r'[a-z0-9]+', unidecode(text or '').lower()))
+
+
+def trigrams(text):
+    ''' pg_trgm style trigrams: every word padded with two leading and one trailing blank '''
+    grams = set()
+    for word in normalize(text).split():
+        word = '  %s ' % word
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class TrigramIndex(object):
+    '''
+    Inverted index trigram -> slots. Each name gets a slot; posting lists
+    are compact unsigned int arrays and freed slots are reused.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # held by the one thread (re)building the index
+        self.build_lock = threading.Lock()
+        self.building = False
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        self.slots = {}
+        self.keys = []
+        self.sizes = array('I')
+        self.names = []
+        self.postings = {}
+        self.free = []
+        self.built_at = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def build(self):
+        '''
+        (Re)load every title and name from the database into a new
+        index and swap it in, so queries meanwhile use the old one
+        '''
+        self.building, self.dirty = True, False
+        try:
+            fresh = TrigramIndex()
+            for pk, title in Book.objects.values_list('id', 'title').iterator():
+                fresh.add(BOOK, pk, title)
+            for pk, name in Author.objects.values_list('id', 'name').iterator():
+                fresh.add(AUTHOR, pk, name)
+            for pk, name in Publisher.objects.values_list('id', 'name').iterator():
+                fresh.add(PUBLISHER, pk, name)
+            with self.lock:
+                for name in ('slots', 'keys', 'sizes', 'names', 'postings', 'free'):
+                    setattr(self, name, getattr(fresh, name))
+                self.built_at = time.time()
+        finally:
+            self.building = False
+
+    def is_stale(self):
+        ttl = settings.CATALOG_FUZZY_INDEX_TTL
+        return self.built_at is None or self.dirty or bool(ttl and time.time() - self.built_at > ttl)
+
+    def ensure_fresh(self):
+        '''
+        Build the index on first use (concurrent first requests wait for
+        one build), later start a background rebuild when it is stale
+        '''
+        if self.built_at is None:
+            with self.build_lock:
+                if self.built_at is None:
+                    self.build()
+        elif self.is_stale() and self.build_lock.acquire(False):
+            threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def rebuild(self):
+        ''' Background rebuild, run with build_lock held '''
+        try:
+            self.build()
+        except Exception:
+            self.dirty = True
+            raise
+        finally:
+            self.build_lock.release()
+            close_old_connections()
+
+    def add(self, kind, pk, name):
+        ''' Index or re-index the name of one object '''
+        with self.lock:
+            if self.building:
+                # the rows being loaded may predate this edit
+                self.dirty = True
+            self.remove(kind, pk)
+            grams = trigrams(name)
+            if not grams:
+                return
+            if self.free:
+                slot = self.free.pop()
+                self.keys[slot], self.sizes[slot], self.names[slot] = (kind, pk), len(grams), name
+            else:
+                slot = len(self.keys)
+                self.keys.append((kind, pk))
+                self.sizes.append(len(grams))
+                self.names.append(name)
+            self.slots[(kind, pk)] = slot
+            for gram in grams:
+                self.postings.setdefault(gram, array('I')).append(slot)
+
+    def remove(self, kind, pk):
+        ''' Drop one object from the index '''
+        with self.lock:
+            if self.building:
+                self.dirty = True
+            slot = self.slots.pop((kind, pk), None)
+            if slot is None:
+                return
+            for gram in trigrams(self.names[slot]):
+                posting = self.postings[gram]
+                posting.remove(slot)
+                if not posting:
+                    del self.postings[gram]
+            self.keys[slot], self.names[slot] = None, None
+            self.free.append(slot)
+
+    def query(self, text, threshold=None, limit=None):
+        '''
+        [(kind, pk, score)] of names similar to `text`, best first.
+        The score is the share of the query's trigrams found in the name,
+        with whole-name similarity breaking ties.
+        '''
+        if threshold is None:
+            threshold = settings.CATALOG_FUZZY_THRESHOLD
+        grams = trigrams(text)
+        if not grams:
+            return []
+        with self.lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+            matches = []
+            for slot, count in shared.items():
+                score = count / len(grams)
+                if score >= threshold:
+                    similarity = count / (len(grams) + self.sizes[slot] - count)
+                    kind, pk = self.keys[slot]
+                    matches.append((score, similarity, kind, pk))
+        matches.sort(reverse=True)
+        return [(kind, pk, score) for score, similarity, kind, pk in matches[:limit]]
+
+
+trigram_index = TrigramIndex()
+
+
+def get_trigram_index():
+    ''' The process index, built on first use and refreshed in the background '''
+    trigram_index.ensure_fresh()
+    return trigram_index
+
+
+def fuzzy_book_ids(text, threshold=None, limit=None):
+    '''
+    OrderedDict book id -> score of books whose title, author or
+    publisher resembles `text`
+    '''
+    limit = limit or settings.CATALOG_FUZZY_LIMIT
+    scores = {}
+    authors, publishers = {}, {}
+    for kind, pk, score in get_trigram_index().query(text, threshold, limit):
+        if kind == BOOK:
+            scores[pk] = max(score, scores.get(pk, 0))
+        elif kind == AUTHOR:
+            authors[pk] = score
+        else:
+            publishers[pk] = score
+    if authors:
+        for book_id, author_id in Book.author.through.objects.filter(
+                author_id__in=authors).values_list('book_id', 'author_id'):
+            scores[book_id] = max(authors[author_id], scores.get(book_id, 0))
+    if publishers:
+        for book_id, publisher_id in Book.objects.filter(
+                publisher_id__in=publishers).values_list('id', 'publisher_id'):
+            scores[book_id] = max(publishers[publisher_id], scores.get(book_id, 0))
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return OrderedDict(ranked[:limit])
+
+
+def fuzzy_search(queryset, text, threshold=None):
+    '''
+    Restrict `queryset` to fuzzy matches of `text`, annotated with the
+    similarity as `search_rank` and ordered by it
+    '''
+    scores = fuzzy_book_ids(text, threshold)
+    rank = Value(0.0, output_field=FloatField())
+    if scores:
+        rank = Case(*[When(id=book_id, then=Value(score)) for book_id, score in scores.items()],
+                    default=Value(0.0), output_field=FloatField())
+    return queryset.filter(id__in=list(scores)).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+
+@receiver(post_save, sender=Book)
+def index_book_title(sender, instance, raw=False, **kwargs):
+    if trigram_index.built_at is not None:
+        trigram_index.add(BOOK, instance.pk, instance.title)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+def index_name(sender, instance, raw=False, **kwargs):
+    if trigram_index.built_at is not None:
+        trigram_index.add(AUTHOR if sender is Author else PUBLISHER, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+def unindex_name(sender, instance, **kwargs):
+    kind = {Book: BOOK, Author: AUTHOR, Publisher: PUBLISHER}[sender]
+    trigram_index.remove(kind, instance.pk)
@@ -0,0 +1,66 @@
+'''
+Micro-benchmark of ApiRenderer on a synthetic book listing
+'''
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from rest_framework.response import Response
+from rest_framework.utils.serializer_helpers import ReturnList
+
+from bookstore.core import renderers
+from bookstore.core.renderers import ApiRenderer
+
+
+def book_payload(count):
+    ''' BooksListingSerializer shaped data for `count` books '''
+    return ReturnList([OrderedDict([
+        ('id', pk),
+        ('title', 'Book number %d – a title with some length' % pk),
+        ('price', 100 + pk % 900),
+        ('genre', pk % 12),
+        ('publisher', 'Publisher %d' % (pk % 40)),
+        ('author', [OrderedDict([('id', pk * 2 + n), ('name', 'Author %d' % (pk * 2 + n))])
+                    for n in range(2)]),
+        ('image', '/media/books/%d.jpg' % pk),
+    ]) for pk in range(1, count + 1)], serializer=None)
+
+
+class Command(BaseCommand):
+    help = 'Compare bytes/sec and peak allocations of the fast and the json.dumps ApiRenderer paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000, help='Books in the payload')
+        parser.add_argument('--rounds', type=int, default=200, help='Renders timed per path')
+
+    def measure(self, renderer, payload, rounds):
+        context = {'response': Response()}
+        body = renderer.render(payload, renderer_context=context)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            renderer.render(payload, renderer_context=context)
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        renderer.render(payload, renderer_context=context)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return body, len(body) * rounds / elapsed, peak
+
+    def handle(self, *args, **options):
+        payload = book_payload(options['books'])
+        legacy = ApiRenderer()
+        legacy.fast_path = False
+        fast = ApiRenderer()
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed, both paths use json.dumps'))
+
+        results = []
+        for name, renderer in (('json.dumps', legacy), ('fast path', fast)):
+            body, rate, peak = self.measure(renderer, payload, options['rounds'])
+            results.append(body)
+            self.stdout.write('%-10s %8d bytes  %8.1f MB/s  peak %8.1f KiB' % (
+                name, len(body), rate / 1e6, peak / 1024.0))
+        if results[0] != results[1]:
+            self.stdout.write(self.style.ERROR('The two paths rendered different bodies'))
@@ -0,0 +1,30 @@
+'''
+Build the cover renditions of existing books
+'''
+from django.core.management.base import BaseCommand
+
+from catalog.models import Book
+from catalog.renditions import build_renditions
+
+
+class Command(BaseCommand):
+    help = 'Resize book covers into the CATALOG_IMAGE_RENDITIONS sizes (JPEG and WebP)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int,
+                            help='Only build renditions of these books (default: all books)')
+
+    def handle(self, *args, **options):
+        queryset = Book.objects.exclude(image='').exclude(image__isnull=True)
+        if options['book_ids']:
+            queryset = queryset.filter(id__in=options['book_ids'])
+        built = failed = 0
+        for book_id, name in queryset.values_list('id', 'image').iterator():
+            try:
+                build_renditions(book_id, name)
+            except (IOError, OSError) as error:
+                failed += 1
+                self.stderr.write('%s: %s' % (name, error))
+                continue
+            built += 1
+        self.stdout.write(self.style.SUCCESS('Built renditions for %d books, %d failed' % (built, failed)))
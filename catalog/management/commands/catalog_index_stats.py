@@ -0,0 +1,18 @@
+'''
+Report the size of the in-memory catalog indexes
+'''
+from django.core.management.base import BaseCommand
+
+from catalog.filter_index import get_filter_index
+
+
+class Command(BaseCommand):
+    help = 'Build the in-memory catalog indexes and print their approximate memory footprint'
+
+    def handle(self, *args, **options):
+        index = get_filter_index()
+        usage = index.memory_usage()
+        self.stdout.write('Filter index: %d books' % len(index.books))
+        for name, size in sorted(usage.items()):
+            self.stdout.write('  %-14s %10d bytes' % (name, size))
+        self.stdout.write('  %-14s %10d bytes' % ('total', sum(usage.values())))
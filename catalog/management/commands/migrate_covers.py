@@ -0,0 +1,97 @@
+'''
+Move book covers to content addressed names and collect orphaned files
+'''
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bookstore.core.storage import is_content_addressed
+from catalog.models import Book, CatalogVersion
+from catalog.renditions import build_renditions
+
+RENDITIONS_DIR = 'renditions/'
+
+
+class Command(BaseCommand):
+    help = ('Rename book covers after the hash of their content, so identical covers are stored once, '
+            'and with --gc delete cover and rendition files no book refers to')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gc', action='store_true',
+                            help='Delete cover and rendition files no book refers to')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Leave files younger than this many seconds alone (default: an hour)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be moved or deleted')
+
+    def handle(self, *args, **options):
+        field = Book._meta.get_field('image')
+        self.storage = field.storage
+        self.upload_to = field.upload_to
+        self.dry_run = options['dry_run']
+        # old names of the covers moved by this run
+        self.migrated = set()
+        self.migrate()
+        if options['gc']:
+            self.collect(time.time() - options['min_age'])
+
+    def covers(self):
+        return Book.objects.exclude(image='').exclude(image__isnull=True).values_list('id', 'image')
+
+    def migrate(self):
+        moved = 0
+        for book_id, name in list(self.covers()):
+            if is_content_addressed(name):
+                continue
+            if not self.storage.exists(name):
+                self.stderr.write('Book %d: %s does not exist' % (book_id, name))
+                continue
+            moved += 1
+            if self.dry_run:
+                self.stdout.write('Would move %s' % name)
+                continue
+            with self.storage.open(name) as original:
+                new_name = self.storage.save(name, original)
+            Book.objects.filter(id=book_id, image=name).update(image=new_name, last_modified=timezone.now())
+            self.migrated.add(name)
+            try:
+                build_renditions(book_id, new_name)
+            except (IOError, OSError) as error:
+                self.stderr.write('Book %d: no renditions of %s: %s' % (book_id, new_name, error))
+        if self.migrated:
+            # update() sends no signals: expire cached responses and fragments pointing at the old names
+            CatalogVersion.bump()
+        self.stdout.write(self.style.SUCCESS('%s %d covers' % ('Would move' if self.dry_run else 'Moved', moved)))
+
+    def walk(self, top):
+        ''' Storage names of the files under the directory `top` '''
+        root = self.storage.path('')
+        for directory, dirs, files in os.walk(self.storage.path(top)):
+            for filename in files:
+                yield os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, '/')
+
+    def collect(self, cutoff):
+        # covers moved by this run may still be referenced by pages cached
+        # before it, leave them to the next collection
+        referenced = set(name for book_id, name in self.covers()) | self.migrated
+        stems = set(os.path.splitext(name)[0] for name in referenced)
+        orphans = [name for name in self.walk(self.upload_to) if name not in referenced]
+        # renditions live in renditions/<cover name without extension>/
+        orphans += [name for name in self.walk(RENDITIONS_DIR + self.upload_to)
+                    if os.path.dirname(name)[len(RENDITIONS_DIR):] not in stems]
+        removed = freed = 0
+        for name in orphans:
+            path = self.storage.path(name)
+            if os.path.getmtime(path) > cutoff:
+                # possibly uploaded for a book that is not saved yet
+                continue
+            removed += 1
+            freed += os.path.getsize(path)
+            if self.dry_run:
+                self.stdout.write('Would delete %s' % name)
+            else:
+                self.storage.delete(name)
+        self.stdout.write(self.style.SUCCESS('%s %d orphaned files (%d bytes)' % (
+            'Would delete' if self.dry_run else 'Deleted', removed, freed)))
@@ -0,0 +1,19 @@
+'''
+Rebuild the full-text search index of the book catalog
+'''
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from catalog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Create (if needed) and repopulate the book full-text search index'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                backend.create_index(cursor)
+            backend.index_books()
+        self.stdout.write(self.style.SUCCESS('Rebuilt search index with %s' % type(backend).__name__))
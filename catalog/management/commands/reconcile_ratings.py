@@ -0,0 +1,21 @@
+'''
+Recompute the denormalised rating aggregates stored on Book
+'''
+from django.core.management.base import BaseCommand
+
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute rating sum, count and per-star counts for books from their reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int,
+                            help='Only reconcile these books (default: all books)')
+
+    def handle(self, *args, **options):
+        queryset = Book.objects.all()
+        if options['book_ids']:
+            queryset = queryset.filter(id__in=options['book_ids'])
+        updated = Book.reconcile_ratings(queryset)
+        self.stdout.write(self.style.SUCCESS('Reconciled ratings for %d books' % updated))
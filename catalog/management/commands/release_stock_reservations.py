@@ -0,0 +1,14 @@
+'''
+Return expired checkout stock reservations to Book.stock_qty
+'''
+from django.core.management.base import BaseCommand
+
+from catalog.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Put the stock of expired checkout reservations back; run it periodically (e.g. from cron)'
+
+    def handle(self, *args, **options):
+        restocked = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS('Restocked %d books from expired reservations' % restocked))
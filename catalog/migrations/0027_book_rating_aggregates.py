@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    Review = apps.get_model('catalog', 'Review')
+
+    def review_aggregate(aggregate, **filters):
+        reviews = Review.objects.filter(book=OuterRef('pk'), **filters).order_by().values('book')
+        return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value'),
+                                 output_field=models.IntegerField()), 0)
+
+    stats = {
+        'rating_sum': review_aggregate(Sum('rating')),
+        'rating_count': review_aggregate(Count('id')),
+    }
+    for star in range(1, 6):
+        stats['rating_%d' % star] = review_aggregate(Count('id'), rating=star)
+    Book.objects.update(**stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0026_auto_20180504_1551'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='book',
+            name='avg_rating',
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+DOCUMENT_SQL = '''
+    SELECT b.id, b.title, {authors} AS authors, p.name AS publisher, g.name AS genre, b.description
+    FROM catalog_book b
+    INNER JOIN catalog_publisher p ON p.id = b.publisher_id
+    INNER JOIN catalog_genre g ON g.id = b.genre_id
+    LEFT OUTER JOIN catalog_book_author ba ON ba.book_id = b.id
+    LEFT OUTER JOIN catalog_author a ON a.id = ba.author_id
+    GROUP BY b.id, b.title, p.name, g.name, b.description
+'''
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        # documents are built with the configuration set at migrate time;
+        # run rebuild_search_index after changing CATALOG_SEARCH_CONFIG
+        config = getattr(settings, 'CATALOG_SEARCH_CONFIG', 'english')
+        schema_editor.execute(
+            'CREATE TABLE IF NOT EXISTS catalog_book_search ('
+            'book_id integer PRIMARY KEY REFERENCES catalog_book (id) ON DELETE CASCADE '
+            'DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS catalog_book_search_document_idx '
+            'ON catalog_book_search USING gin (document)')
+        schema_editor.execute(
+            'INSERT INTO catalog_book_search (book_id, document) '
+            'SELECT d.id, '
+            "setweight(to_tsvector(%s::regconfig, d.title || ' ' || d.authors), 'A') || "
+            "setweight(to_tsvector(%s::regconfig, d.publisher || ' ' || d.genre), 'B') || "
+            "setweight(to_tsvector(%s::regconfig, d.description), 'C') "
+            'FROM (' + DOCUMENT_SQL.format(authors="COALESCE(string_agg(a.name, ' '), '')") + ') d',
+            [config] * 3)
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS catalog_book_fts USING fts5('
+            'title, authors, publisher, genre, description, '
+            "tokenize = 'unicode61 remove_diacritics 1')")
+        schema_editor.execute(
+            'INSERT INTO catalog_book_fts (rowid, title, authors, publisher, genre, description) '
+            + DOCUMENT_SQL.format(authors="COALESCE(GROUP_CONCAT(a.name, ' '), '')"))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_book_search')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_book_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0028_book_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0030_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='added_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
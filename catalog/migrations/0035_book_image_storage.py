@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bookstore.core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0034_catalogversion_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=bookstore.core.storage.ContentAddressedStorage(), upload_to='books/'),
+        ),
+    ]
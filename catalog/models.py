@@ -3,15 +3,15 @@ import itertools
 from unidecode import unidecode
 from django.utils.text import slugify
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.dispatch import receiver
-from django.db.models.signals import post_save, post_delete
-from django.db.models import Avg
-from PIL import Image
-from io import BytesIO
-from django.core.files.uploadedfile import InMemoryUploadedFile
-import sys
+from django.dispatch import receiver, Signal
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.utils import timezone
+from django.db.models.functions import Coalesce
+
+from bookstore.core.storage import cover_storage
 
 
 class Genre (models.Model):
@@ -100,6 +100,8 @@ class Book(models.Model):
         ('published', 'Published'),
         ('pending', 'Pending'),
     )
+    RATING_FIELDS = ('rating_sum', 'rating_count', 'rating_1', 'rating_2',
+                     'rating_3', 'rating_4', 'rating_5')
     isbn = models.CharField(max_length=16)
     title = models.CharField(max_length=100)
     description = models.TextField()
@@ -108,7 +110,7 @@ class Book(models.Model):
     is_featured = models.BooleanField(default=False)
     publisher = models.ForeignKey(Publisher)
     publication_date = models.DateField()
-    image = models.ImageField(null=True, blank= True, upload_to='books/')
+    image = models.ImageField(null=True, blank= True, upload_to='books/', storage=cover_storage)
     pages = models.IntegerField()
     price = models.IntegerField()
     genre = models.ForeignKey(Genre)
@@ -118,9 +120,15 @@ class Book(models.Model):
     slug = models.CharField(max_length=100)
     is_active = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
-    added_date = models.DateTimeField(auto_now_add=True)
+    added_date = models.DateTimeField(auto_now_add=True, db_index=True)
     last_modified = models.DateTimeField(auto_now=True)
-    avg_rating = models.FloatField(blank=True, null= True)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -128,6 +136,49 @@ class Book(models.Model):
     class Meta:
         verbose_name = 'Book'
         verbose_name_plural = 'Books'
+        indexes = [
+            # keyset pagination of the book listings
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['genre', 'title', 'id'], name='book_genre_title_id_idx'),
+        ]
+
+    @property
+    def avg_rating(self):
+        '''
+        Average rating derived from the stored rating aggregates
+        '''
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @property
+    def rating_total(self):
+        '''
+        Per-star review counts plus the overall total
+        '''
+        rating_total = dict((star, getattr(self, 'rating_%d' % star)) for star in range(1, 6))
+        rating_total['total'] = self.rating_count
+        return rating_total
+
+    @classmethod
+    def reconcile_ratings(cls, queryset=None):
+        '''
+        Recompute the stored rating aggregates from the Review table
+        in a single UPDATE statement
+        '''
+        def review_aggregate(aggregate, **filters):
+            reviews = Review.objects.filter(book=OuterRef('pk'), **filters).order_by().values('book')
+            return Coalesce(Subquery(reviews.annotate(value=aggregate).values('value'),
+                                     output_field=models.IntegerField()), 0)
+
+        stats = {
+            'rating_sum': review_aggregate(Sum('rating')),
+            'rating_count': review_aggregate(Count('id')),
+        }
+        for star in range(1, 6):
+            stats['rating_%d' % star] = review_aggregate(Count('id'), rating=star)
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.update(**stats)
 
 
     def save(self, *args, **kwargs):
@@ -144,16 +195,13 @@ class Book(models.Model):
                 sludata = "%s-%d" % (slugify(self.slug), list_iter)
             self.slug = sludata
         
-        if self.image:           
-            im = Image.open(self.image)
-            output = BytesIO()
-            #Resize/modify the image
-            im = im.resize( (200,300) )
-            #after modifications, save it to the output
-            im.save(output, format='JPEG', quality=100)
-            output.seek(0)
-            #change the imagefield value to be the newley modifed image value
-            self.image = InMemoryUploadedFile(output,'ImageField', "%s.jpg" %self.image.name.split('.')[0], 'image/jpeg', sys.getsizeof(output), None)
+        # the original is stored as uploaded, catalog.renditions resizes it
+        # in the background when a new file was assigned
+        self._image_changed = bool(self.image) and not self.image._committed
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # rating aggregates are maintained with F() updates, never overwrite them from a stale instance
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.RATING_FIELDS]
         return super(Book, self).save(*args, **kwargs)
 
 
@@ -178,15 +226,61 @@ class Review(models.Model):
     def __str__(self):
         return '%s rated %s by %s' % (self.book, self.rating , self.customer)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Review, cls).from_db(db, field_names, values)
+        instance._loaded_rating = instance.__dict__.get('rating')
+        instance._loaded_book_id = instance.__dict__.get('book_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # keep the review row and the book's rating aggregates in one transaction
+        with transaction.atomic():
+            super(Review, self).save(*args, **kwargs)
+            self._loaded_rating = int(self.rating)
+            self._loaded_book_id = self.book_id
+
+
+def apply_rating_delta(book_id, rating, sign):
+    '''
+    Add (sign=1) or remove (sign=-1) a single rating on the book aggregates
+    '''
+    rating = int(rating)
+    star = 'rating_%d' % rating
+    Book.objects.filter(id=book_id).update(**{
+        'rating_sum': F('rating_sum') + sign * rating,
+        'rating_count': F('rating_count') + sign,
+        star: F(star) + sign,
+        'last_modified': timezone.now(),
+    })
+
+
+@receiver(pre_save, sender=Review)
+def remember_book_rating(sender, instance, raw=False, **kwargs):
+    if instance.pk and not hasattr(instance, '_loaded_rating'):
+        previous = Review.objects.filter(pk=instance.pk).values('rating', 'book_id').first()
+        instance._loaded_rating = previous and previous['rating']
+        instance._loaded_book_id = previous and previous['book_id']
+
 
 @receiver(post_save, sender=Review)
+def update_book_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_rating = getattr(instance, '_loaded_rating', None)
+    old_book_id = getattr(instance, '_loaded_book_id', None)
+    if not created and old_rating is not None:
+        if old_rating == int(instance.rating) and old_book_id == instance.book_id:
+            # the comment changed, the book page did too
+            Book.objects.filter(id=instance.book_id).update(last_modified=timezone.now())
+            return
+        apply_rating_delta(old_book_id, old_rating, -1)
+    apply_rating_delta(instance.book_id, instance.rating, 1)
+
+
 @receiver(post_delete, sender=Review)
-def update_book_rating(sender, **kwargs):
-    if kwargs:
-        book = kwargs['instance'].book
-        avg_rating = Review.objects.filter(book = book).aggregate(Avg('rating'))
-        book_rating = avg_rating['rating__avg']
-        Book.objects.filter(id = book.id).update(avg_rating = book_rating)
+def remove_book_rating(sender, instance, **kwargs):
+    apply_rating_delta(instance.book_id, getattr(instance, '_loaded_rating', None) or instance.rating, -1)
     
 class Order(models.Model):
     order_choices = (
@@ -207,6 +301,10 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [
+            # keyset pagination of a customer's order history
+            models.Index(fields=['customer', 'order_date', 'id'], name='order_customer_date_id_idx'),
+        ]
 
 class OrderDetail(models.Model):
     order_id = models.ForeignKey(Order, related_name='order_id')
@@ -219,4 +317,56 @@ class OrderDetail(models.Model):
 
     class Meta:
         verbose_name = 'OrderDetail'
-        verbose_name_plural = 'OrderDetails'
\ No newline at end of file
+        verbose_name_plural = 'OrderDetails'
+
+
+class StockReservation(models.Model):
+    '''
+    Stock held for a customer during checkout. The quantity is taken out
+    of Book.stock_qty when reserved and put back if the hold expires
+    before an order uses it (see catalog.stock).
+    '''
+    book = models.ForeignKey(Book, related_name='stock_reservations')
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='stock_reservations')
+    qty = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '{0} x {1}'.format(self.qty, self.book_id)
+
+    class Meta:
+        verbose_name = 'Stock Reservation'
+        verbose_name_plural = 'Stock Reservations'
+
+
+# sent with the new version after every CatalogVersion.bump()
+catalog_version_bumped = Signal(providing_args=['version'])
+
+
+class CatalogVersion(models.Model):
+    '''
+    Single row counter bumped on every catalog change, used to key
+    cached catalog responses so they are never served stale
+    '''
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return '{0}'.format(self.version)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(id=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def state(cls):
+        ''' (version, updated_at) of the catalog, (0, None) before any change '''
+        return cls.objects.filter(id=1).values_list('version', 'updated_at').first() or (0, None)
+
+    @classmethod
+    def bump(cls):
+        now = timezone.now()
+        if not cls.objects.filter(id=1).update(version=F('version') + 1, updated_at=now):
+            cls.objects.get_or_create(id=1, defaults={'version': 1, 'updated_at': now})
+        if catalog_version_bumped.has_listeners(cls):
+            catalog_version_bumped.send(sender=cls, version=cls.current())
@@ -0,0 +1,73 @@
+'''
+Order placement, shared by the web cash-on-delivery checkout and the
+orders API.
+'''
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from catalog.models import Book, Order, OrderDetail
+from catalog.stock import take_stock
+
+
+def differs(amount, expected):
+    ''' Whether a client sent `amount` (None when not sent) differs from `expected` '''
+    if amount in (None, ''):
+        return False
+    try:
+        return float(amount) != expected
+    except (TypeError, ValueError):
+        raise ValidationError('Invalid amount %r' % (amount,))
+
+
+def cart_quantities(lines):
+    '''
+    OrderedDict book id -> quantity of cart `lines`, repeated books merged
+    '''
+    quantities = OrderedDict()
+    for line in lines:
+        try:
+            book_id, qty = int(line['book']), int(line['qty'])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError('Invalid cart line')
+        if qty <= 0:
+            raise ValidationError('Invalid quantity for book %d' % book_id)
+        quantities[book_id] = quantities.get(book_id, 0) + qty
+    if not quantities:
+        raise ValidationError('The cart is empty')
+    return quantities
+
+
+def place_order(customer, lines, total_amt=None, stripe_cust_id=None):
+    '''
+    Create the order of `customer` for cart `lines`
+    ([{'book': id, 'qty': quantity, 'price': unit price}]) in one
+    transaction and a fixed number of queries, whatever the cart size.
+
+    Prices come from the books: a line price or `total_amt` sent by the
+    client that disagrees with them raises ValidationError, as does an
+    unknown book or, with CATALOG_TRACK_STOCK, missing stock.
+    '''
+    quantities = cart_quantities(lines)
+    with transaction.atomic():
+        books = Book.objects.only('id', 'title', 'price').in_bulk(list(quantities))
+        missing = [book_id for book_id in quantities if book_id not in books]
+        if missing:
+            raise ValidationError('Unknown books: %s' % ', '.join(str(book_id) for book_id in missing))
+        for line in lines:
+            book = books[int(line['book'])]
+            if differs(line.get('price'), book.price):
+                raise ValidationError('The price of "%s" has changed' % book.title)
+        total = sum(books[book_id].price * qty for book_id, qty in quantities.items())
+        if differs(total_amt, total):
+            raise ValidationError('The order total has changed')
+        if settings.CATALOG_TRACK_STOCK:
+            take_stock(customer, quantities)
+
+        order = Order.objects.create(customer=customer, total_amt=total, stripe_cust_id=stripe_cust_id)
+        OrderDetail.objects.bulk_create([
+            OrderDetail(order_id=order, bk_id_id=book_id, qty=qty, price=books[book_id].price)
+            for book_id, qty in quantities.items()])
+    return order
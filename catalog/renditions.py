@@ -0,0 +1,160 @@
+'''
+Resized renditions of book covers.
+
+The uploaded cover is stored once as is. Saving a book with a new image
+queues its renditions (CATALOG_IMAGE_RENDITIONS sizes, each as JPEG and,
+when Pillow supports it, WebP) on a small worker pool once the
+transaction commits, so the admin request never waits for PIL. Until a
+rendition exists, `rendition_url` falls back to the original; that
+answer is cached for CATALOG_RENDITION_MISSING_TIMEOUT seconds, or until
+the renditions are written. Writing them touches the book's
+`last_modified`, so cached fragments and validators pick them up.
+
+With CATALOG_IMAGE_WORKERS = 0 renditions are made inline (tests and
+management commands).
+'''
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from bookstore.core.cache import cache
+from catalog.models import Book
+
+FORMATS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+logger = logging.getLogger(__name__)
+
+executor = None
+executor_lock = threading.Lock()
+pending = set()
+
+
+def webp_supported():
+    return features.check('webp')
+
+
+def rendition_name(name, size, fmt='jpeg'):
+    ''' Storage name of the `size` rendition of the image stored as `name` '''
+    return 'renditions/%s/%s.%s' % (os.path.splitext(name)[0], size, FORMATS[fmt])
+
+
+def stored_url(name):
+    ''' URL of the stored file `name`, None when it does not exist (yet) '''
+    if default_storage.exists(name):
+        return default_storage.url(name)
+    return None
+
+
+def rendition_cache_key(target):
+    return 'catalog:rendition:%s' % target
+
+
+def existing_rendition_url(name, size, fmt='jpeg'):
+    ''' URL of a rendition of the image stored as `name`, None until it is made '''
+    target = rendition_name(name, size, fmt)
+    key = rendition_cache_key(target)
+    url = cache.get(key)
+    if url is None:
+        url = stored_url(target)
+        # a missing rendition is cached as '' for a short while only
+        cache.set(key, url or '', None if url else settings.CATALOG_RENDITION_MISSING_TIMEOUT)
+    return url or None
+
+
+def rendition_url(image, size, fmt='jpeg'):
+    ''' URL of a rendition of `image`, the original's until it is made '''
+    if not image:
+        return None
+    return existing_rendition_url(image.name, size, fmt) or image.url
+
+
+def encode(image, fmt):
+    output = BytesIO()
+    if fmt == 'webp':
+        image.save(output, format='WEBP', quality=settings.CATALOG_IMAGE_WEBP_QUALITY, method=4)
+    else:
+        image.save(output, format='JPEG', quality=settings.CATALOG_IMAGE_JPEG_QUALITY,
+                   optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def open_cover(name):
+    ''' The stored cover `name` decoded as an RGB (or greyscale) image '''
+    with Book._meta.get_field('image').storage.open(name) as original:
+        image = Image.open(original)
+        image.load()
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGBA').convert('RGB') if image.mode == 'P' else image.convert('RGB')
+    return image
+
+
+def make_renditions(name):
+    '''
+    Write every rendition of the stored image `name`, returning their names
+    '''
+    image = open_cover(name)
+    formats = ['jpeg'] + (['webp'] if webp_supported() else [])
+    written = []
+    for size, box in settings.CATALOG_IMAGE_RENDITIONS.items():
+        # crop to the box's aspect ratio instead of stretching
+        resized = ImageOps.fit(image, box, Image.LANCZOS)
+        for fmt in formats:
+            target = rendition_name(name, size, fmt)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            written.append(default_storage.save(target, ContentFile(encode(resized, fmt))))
+            cache.delete(rendition_cache_key(target))
+    return written
+
+
+def build_renditions(book_id, name):
+    make_renditions(name)
+    Book.objects.filter(id=book_id, image=name).update(last_modified=timezone.now())
+
+
+def run_worker(book_id, name):
+    try:
+        build_renditions(book_id, name)
+    except Exception:
+        logger.exception('Renditions of %s failed', name)
+    finally:
+        pending.discard(name)
+        close_old_connections()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=settings.CATALOG_IMAGE_WORKERS)
+        return executor
+
+
+def queue_renditions(book_id, name):
+    ''' Build the renditions of `name` on the worker pool, once per image '''
+    if not settings.CATALOG_IMAGE_WORKERS:
+        return build_renditions(book_id, name)
+    if name in pending:
+        return
+    pending.add(name)
+    get_executor().submit(run_worker, book_id, name)
+
+
+@receiver(post_save, sender=Book)
+def queue_book_renditions(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_image_changed', False) or not instance.image:
+        return
+    instance._image_changed = False
+    book_id, name = instance.pk, instance.image.name
+    transaction.on_commit(lambda: queue_renditions(book_id, name))
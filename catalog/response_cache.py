@@ -0,0 +1,121 @@
+'''
+Cache of catalog API responses.
+
+Responses are cached by endpoint, host and normalized query parameters
+under the current catalog version. Any change to a book, author,
+publisher or genre bumps the version (see the receivers at the bottom of
+this module), so every entry written before the edit is unreachable from
+then on and simply expires. Entries live in the two tier cache, so
+concurrent misses on one key build the response once.
+'''
+import hashlib
+import pickle
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.response import Response
+
+from bookstore.core.cache import cache
+from catalog.models import Book, Author, Publisher, Genre, CatalogVersion
+
+
+class ResponseCacheStats(object):
+    '''
+    Per process hit/miss counters and stored bytes by endpoint
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(lambda: {'hits': 0, 'misses': 0, 'stored': 0, 'bytes': 0})
+
+    def hit(self, endpoint):
+        with self.lock:
+            self.endpoints[endpoint]['hits'] += 1
+
+    def miss(self, endpoint, size=None):
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats['misses'] += 1
+            if size is not None:
+                stats['stored'] += 1
+                stats['bytes'] += size
+
+    def report(self):
+        report = {}
+        with self.lock:
+            for endpoint, stats in self.endpoints.items():
+                requests = stats['hits'] + stats['misses']
+                report[endpoint] = dict(
+                    stats,
+                    hit_rate=stats['hits'] / requests if requests else 0,
+                    avg_entry_bytes=stats['bytes'] // stats['stored'] if stats['stored'] else 0)
+        return report
+
+
+response_cache_stats = ResponseCacheStats()
+
+
+def response_cache_key(endpoint, request, version):
+    ''' Cache key for an endpoint and the normalized query string of `request` '''
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    raw = repr((request.get_host(), request.accepted_media_type, params))
+    return 'catalog:response:%s:%s:%s' % (version, endpoint, hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+class CachedResponseMixin(object):
+    '''
+    Serve GET responses of a catalog API view from the response cache
+    '''
+    response_cache_timeout = settings.CATALOG_RESPONSE_CACHE_TIMEOUT
+
+    def get_cache_endpoint(self):
+        return type(self).__name__
+
+    def get(self, request, *args, **kwargs):
+        endpoint = self.get_cache_endpoint()
+        # kept for the view, e.g. to check the filter index without another query
+        self.catalog_version = CatalogVersion.current()
+        key = response_cache_key(endpoint, request, self.catalog_version)
+        computed = []
+
+        def render():
+            response = super(CachedResponseMixin, self).get(request, *args, **kwargs)
+            computed.append(response)
+            if response.status_code != status.HTTP_200_OK:
+                return None
+            # stored pre-pickled so the entry size is known
+            return pickle.dumps(response.data, pickle.HIGHEST_PROTOCOL)
+
+        payload = cache.get_or_compute(key, render, self.response_cache_timeout)
+        if computed:
+            response = computed[0]
+            response_cache_stats.miss(endpoint, len(payload) if payload is not None else None)
+            response['X-Cache'] = 'MISS'
+            return response
+        response_cache_stats.hit(endpoint)
+        response = Response(pickle.loads(payload))
+        response['X-Cache'] = 'HIT'
+        return response
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Genre)
+def bump_catalog_version(sender, raw=False, **kwargs):
+    if not raw:
+        CatalogVersion.bump()
+
+
+@receiver(m2m_changed, sender=Book.author.through)
+def bump_catalog_version_m2m(sender, action, **kwargs):
+    if action.startswith('post_'):
+        CatalogVersion.bump()
@@ -0,0 +1,46 @@
+'''
+Review summary for the book detail page
+'''
+from django.conf import settings
+
+from catalog.models import Review
+
+
+class ReviewSummary(object):
+    '''
+    Collects everything the book detail page shows about reviews with a
+    fixed number of queries, however many reviews the book has:
+    the star histogram comes from the aggregates stored on the book,
+    the user's own review is one lookup and the review list is a keyset
+    page ordered by newest first.
+    '''
+
+    def __init__(self, book, user=None, page_size=None):
+        self.book = book
+        self.user = user
+        self.page_size = page_size or settings.REVIEWS_PAGE_SIZE
+
+    def histogram(self):
+        ''' 1-5 star counts plus the total '''
+        return self.book.rating_total
+
+    def user_review(self):
+        ''' Review left by the current user, if any '''
+        if self.user is None or self.user.is_anonymous():
+            return None
+        return Review.objects.filter(book=self.book, customer=self.user).first()
+
+    def page(self, before=None):
+        '''
+        Return a page of reviews older than the review id `before`
+        together with the cursor for the next page (None on the last page)
+        '''
+        reviews = Review.objects.filter(book=self.book).select_related('customer').order_by('-id')
+        if before:
+            reviews = reviews.filter(id__lt=before)
+        reviews = list(reviews[:self.page_size + 1])
+        next_cursor = None
+        if len(reviews) > self.page_size:
+            reviews = reviews[:self.page_size]
+            next_cursor = reviews[-1].id
+        return reviews, next_cursor
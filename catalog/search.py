@@ -0,0 +1,254 @@
+'''
+Full-text search over the book catalog.
+
+The backend is chosen with the CATALOG_SEARCH_BACKEND setting (dotted path);
+left empty it follows the database engine: a tsvector document table with a
+GIN index on PostgreSQL, an FTS5 table on SQLite and plain icontains
+lookups anywhere else. The index tables are kept current by the signal
+receivers at the bottom of this module.
+'''
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from catalog.models import Book, Author, Publisher, Genre
+
+# one document per book: title and authors, publisher and genre, description
+DOCUMENT_SQL = '''
+    SELECT b.id, b.title, {authors} AS authors, p.name AS publisher, g.name AS genre, b.description
+    FROM catalog_book b
+    INNER JOIN catalog_publisher p ON p.id = b.publisher_id
+    INNER JOIN catalog_genre g ON g.id = b.genre_id
+    LEFT OUTER JOIN catalog_book_author ba ON ba.book_id = b.id
+    LEFT OUTER JOIN catalog_author a ON a.id = ba.author_id
+    {where}
+    GROUP BY b.id, b.title, p.name, g.name, b.description
+'''
+
+
+def id_filter(column, ids):
+    ''' SQL fragment and params restricting `column` to `ids` (None means all rows) '''
+    if ids is None:
+        return '', []
+    return 'WHERE %s IN (%s)' % (column, ', '.join(['%s'] * len(ids))), list(ids)
+
+
+class BaseSearchBackend(object):
+    '''
+    Search backend interface
+    '''
+    # ids per statement when reindexing
+    batch_size = 500
+
+    def search(self, queryset, text):
+        '''
+        Restrict `queryset` to books matching `text`, annotated with a
+        `search_rank` (higher is better) and ordered by it
+        '''
+        raise NotImplementedError
+
+    def create_index(self, cursor):
+        ''' Create the index table(s) '''
+
+    def index_books(self, book_ids=None):
+        ''' (Re)build the index entries of `book_ids`, or of every book '''
+        if book_ids is None:
+            self.remove_books(None)
+            return self.write_documents(None)
+        book_ids = list(book_ids)
+        for start in range(0, len(book_ids), self.batch_size):
+            batch = book_ids[start:start + self.batch_size]
+            self.remove_books(batch)
+            self.write_documents(batch)
+
+    def remove_books(self, book_ids):
+        ''' Drop the index entries of `book_ids` '''
+
+    def write_documents(self, book_ids):
+        ''' Insert index entries for `book_ids` '''
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    '''
+    icontains lookups, for databases without a full-text engine
+    '''
+
+    def search(self, queryset, text):
+        query = (Q(title__icontains=text) | Q(description__icontains=text) |
+                 Q(publisher__name__icontains=text) | Q(genre__name__icontains=text) |
+                 Q(id__in=Book.author.through.objects.filter(
+                     author__name__icontains=text).values('book_id')))
+        return queryset.filter(query).annotate(search_rank=Case(
+            When(title__icontains=text, then=Value(2.0)),
+            default=Value(1.0), output_field=FloatField())).order_by('-search_rank', 'id')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    '''
+    Weighted tsvector documents in catalog_book_search, GIN indexed,
+    ranked with ts_rank
+    '''
+    config = getattr(settings, 'CATALOG_SEARCH_CONFIG', 'english')
+
+    def search(self, queryset, text):
+        params = [self.config, text]
+        matches = RawSQL(
+            'SELECT book_id FROM catalog_book_search '
+            'WHERE document @@ plainto_tsquery(%s::regconfig, %s)', params)
+        rank = RawSQL(
+            'SELECT CAST(ts_rank(document, plainto_tsquery(%s::regconfig, %s)) AS double precision) '
+            'FROM catalog_book_search WHERE book_id = catalog_book.id', params,
+            output_field=FloatField())
+        return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+    def create_index(self, cursor):
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS catalog_book_search ('
+            'book_id integer PRIMARY KEY REFERENCES catalog_book (id) ON DELETE CASCADE '
+            'DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS catalog_book_search_document_idx '
+            'ON catalog_book_search USING gin (document)')
+
+    def remove_books(self, book_ids):
+        where, params = id_filter('book_id', book_ids)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM catalog_book_search %s' % where, params)
+
+    def write_documents(self, book_ids):
+        where, params = id_filter('b.id', book_ids)
+        documents = DOCUMENT_SQL.format(authors="COALESCE(string_agg(a.name, ' '), '')", where=where)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO catalog_book_search (book_id, document) '
+                'SELECT d.id, '
+                "setweight(to_tsvector(%s::regconfig, d.title || ' ' || d.authors), 'A') || "
+                "setweight(to_tsvector(%s::regconfig, d.publisher || ' ' || d.genre), 'B') || "
+                "setweight(to_tsvector(%s::regconfig, d.description), 'C') "
+                'FROM (' + documents + ') d', [self.config] * 3 + params)
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    '''
+    FTS5 shadow table catalog_book_fts keyed by book id, ranked with bm25
+    '''
+    # bm25 column weights: title, authors, publisher, genre, description
+    weights = (10.0, 8.0, 3.0, 3.0, 1.0)
+
+    @staticmethod
+    def match_expression(text):
+        ''' Quote every word of `text` as an FTS5 prefix term '''
+        terms = re.findall(r'\w+', text, re.UNICODE)
+        return ' '.join('"%s"*' % term for term in terms)
+
+    def search(self, queryset, text):
+        expression = self.match_expression(text)
+        if not expression:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        matches = RawSQL('SELECT rowid FROM catalog_book_fts WHERE catalog_book_fts MATCH %s', [expression])
+        rank = RawSQL(
+            'SELECT -bm25(catalog_book_fts, %s) FROM catalog_book_fts '
+            'WHERE catalog_book_fts MATCH %%s AND rowid = catalog_book.id'
+            % ', '.join(str(weight) for weight in self.weights),
+            [expression], output_field=FloatField())
+        return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by('-search_rank', 'id')
+
+    def create_index(self, cursor):
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS catalog_book_fts USING fts5('
+            'title, authors, publisher, genre, description, '
+            "tokenize = 'unicode61 remove_diacritics 1')")
+
+    def remove_books(self, book_ids):
+        where, params = id_filter('rowid', book_ids)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM catalog_book_fts %s' % where, params)
+
+    def write_documents(self, book_ids):
+        where, params = id_filter('b.id', book_ids)
+        documents = DOCUMENT_SQL.format(authors="COALESCE(GROUP_CONCAT(a.name, ' '), '')", where=where)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO catalog_book_fts (rowid, title, authors, publisher, genre, description) '
+                + documents, params)
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    '''
+    Configured search backend instance
+    '''
+    backend_path = getattr(settings, 'CATALOG_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return VENDOR_BACKENDS.get(connection.vendor, SimpleSearchBackend)()
+
+
+def search_books(queryset, text):
+    ''' Ranked, de-duplicated books of `queryset` matching `text` '''
+    return get_search_backend().search(queryset, text)
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    get_search_backend().remove_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.author.through)
+def index_book_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # clearing from the author side: its books are unknown once cleared
+        instance._search_book_ids = list(instance.book_set.values_list('id', flat=True))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        book_ids = [instance.pk]
+    else:
+        book_ids = pk_set or getattr(instance, '_search_book_ids', None)
+    if book_ids:
+        get_search_backend().index_books(book_ids)
+
+
+@receiver(pre_delete, sender=Author)
+def remember_author_books(sender, instance, **kwargs):
+    instance._search_book_ids = list(instance.book_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def index_deleted_author_books(sender, instance, **kwargs):
+    book_ids = getattr(instance, '_search_book_ids', None)
+    if book_ids:
+        get_search_backend().index_books(book_ids)
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        get_search_backend().index_books(instance.book_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Genre)
+def index_related_books(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        get_search_backend().index_books(instance.book_set.values_list('id', flat=True))
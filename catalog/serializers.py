@@ -1,51 +1,87 @@
+from django.core.exceptions import ValidationError
 from rest_framework import serializers
+from bookstore.core.eager import SparseFieldsMixin, eager_load
 from catalog.models import Genre, Book, Author, Publisher, Order, OrderDetail
+from catalog.orders import place_order
 
-class CategoryListingSerializer(serializers.ModelSerializer):
+class CategoryListingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Genre
         fields = ('id', 'name')
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = ['id', 'name']
 
-class PublisherSerializer(serializers.ModelSerializer):
+class PublisherSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Publisher
         fields = ['id', 'name']
 
-class BooksListingSerializer(serializers.ModelSerializer):
+class BooksListingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True, many=True)
     publisher = serializers.ReadOnlyField(source='publisher.name')
     class Meta:
         model = Book
         fields = ('id', 'title', 'price', 'genre', 'publisher', 'author', 'image')
+        select_related = ('publisher',)
+        prefetch_related = ('author',)
 
-class BookDetailSerializer(serializers.ModelSerializer):
+class BookDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True, many=True)
     publisher = serializers.ReadOnlyField(source='publisher.name')
     genre = serializers.ReadOnlyField(source='genre.name')
     class Meta:
         model = Book
         fields = ('isbn', 'id', 'title', 'description', 'author', 'publisher', 'publication_date', 'image', 'pages', 'price', 'genre')
+        select_related = ('publisher', 'genre')
+        prefetch_related = ('author',)
 
-class OrdersDetailViewSerializer(serializers.ModelSerializer):
+class OrdersDetailViewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # a plain id, so validating a cart does not fetch its books one by one
+    bk_id = serializers.IntegerField(source='bk_id_id')
     book = BookDetailSerializer(source='bk_id', read_only=True)
     class Meta(object):
         model = OrderDetail
         fields = ('bk_id', 'qty', 'price','book')
+        select_related = ('bk_id',)
 
-class OrdersViewSerializer(serializers.ModelSerializer):
+class OrderLineSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    book = serializers.ReadOnlyField(source='bk_id_id')
+    title = serializers.ReadOnlyField(source='bk_id.title')
+    class Meta(object):
+        model = OrderDetail
+        fields = ('book', 'title', 'qty', 'price')
+        select_related = ('bk_id',)
+
+class OrderLineDetailSerializer(OrderLineSerializer):
+    detail = BookDetailSerializer(source='bk_id', read_only=True)
+    class Meta(OrderLineSerializer.Meta):
+        fields = OrderLineSerializer.Meta.fields + ('detail',)
+
+class OrderHistorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    lines = OrderLineSerializer(source='order_id', many=True, read_only=True)
+    class Meta(object):
+        model = Order
+        fields = ('id', 'order_date', 'order_time', 'total_amt', 'status', 'lines')
+
+class OrderHistoryDetailSerializer(OrderHistorySerializer):
+    lines = OrderLineDetailSerializer(source='order_id', many=True, read_only=True)
+
+class OrdersViewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     order_id = OrdersDetailViewSerializer(many=True)
     class Meta(object):
         model = Order
         fields = ('customer', 'stripe_cust_id', 'total_amt', 'order_date', 'order_time', 'order_id')
+        prefetch_related = ('order_id',)
     def create(self, validated_data):
-        order_data = validated_data.pop('order_id')
-        order = Order.objects.create(**validated_data)
-        for order_detail in order_data:
-            OrderDetail.objects.create(order_id=order, **order_detail)
-        return order
\ No newline at end of file
+        lines = [{'book': line['bk_id_id'], 'qty': line.get('qty'), 'price': line['price']}
+                 for line in validated_data['order_id']]
+        try:
+            order = place_order(validated_data['customer'], lines, validated_data['total_amt'],
+                                validated_data.get('stripe_cust_id'))
+        except ValidationError as error:
+            raise serializers.ValidationError(error.messages)
+        return eager_load(Order.objects.filter(pk=order.pk), type(self)).get()
\ No newline at end of file
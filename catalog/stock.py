@@ -0,0 +1,119 @@
+'''
+Stock keeping for Book.stock_qty.
+
+Stock is only ever changed with conditional UPDATEs
+(`stock_qty = stock_qty - n WHERE stock_qty >= n`), so concurrent
+checkouts can never oversell, and the rows of one call are always updated
+in ascending book id order, so two carts sharing books lock them in the
+same order and cannot deadlock.
+
+A checkout may hold stock with `reserve_stock`; the order later consumes
+the hold in `take_stock`, and holds left unused past
+CATALOG_STOCK_RESERVATION_TIMEOUT seconds are returned by
+`release_expired_reservations` (the release_stock_reservations command).
+'''
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from catalog.models import Book, StockReservation
+
+
+class OutOfStock(ValidationError):
+    '''
+    Not enough stock left for a book
+    '''
+
+    def __init__(self, book_id):
+        title = Book.objects.filter(pk=book_id).values_list('title', flat=True).first()
+        super(OutOfStock, self).__init__('Not enough stock of "%s"' % (title or book_id))
+        self.book_id = book_id
+
+
+def adjust_stock(deltas):
+    '''
+    Apply {book id: quantity} changes, positive amounts being taken out of
+    stock and negative ones put back. Raises OutOfStock, leaving the
+    stock untouched, when a book has less than it should give.
+    '''
+    book_ids = sorted(book_id for book_id, qty in deltas.items() if qty)
+    if not book_ids:
+        return
+    with transaction.atomic():
+        for book_id in book_ids:
+            qty = deltas[book_id]
+            books = Book.objects.filter(pk=book_id)
+            if qty > 0:
+                books = books.filter(stock_qty__gte=qty)
+            if not books.update(stock_qty=F('stock_qty') - qty):
+                raise OutOfStock(book_id)
+        Book.objects.filter(pk__in=book_ids, stock_qty__lte=0).update(stock_free=True)
+        Book.objects.filter(pk__in=book_ids, stock_qty__gt=0).update(stock_free=False)
+
+
+def reserve_stock(customer, quantities, timeout=None):
+    '''
+    Hold {book id: quantity} for `customer` until `timeout` seconds from
+    now (CATALOG_STOCK_RESERVATION_TIMEOUT by default)
+    '''
+    if timeout is None:
+        timeout = settings.CATALOG_STOCK_RESERVATION_TIMEOUT
+    expires_at = timezone.now() + datetime.timedelta(seconds=timeout)
+    with transaction.atomic():
+        adjust_stock(quantities)
+        return StockReservation.objects.bulk_create([
+            StockReservation(book_id=book_id, customer=customer, qty=qty, expires_at=expires_at)
+            for book_id, qty in sorted(quantities.items()) if qty > 0])
+
+
+def held_quantities(reservations):
+    ''' Delete `reservations` and return the {book id: quantity} they held '''
+    held = defaultdict(int)
+    ids = []
+    for pk, book_id, qty in reservations.order_by('book_id', 'id').values_list('id', 'book_id', 'qty'):
+        held[book_id] += qty
+        ids.append(pk)
+    if ids:
+        StockReservation.objects.filter(pk__in=ids).delete()
+    return held
+
+
+def live_reservations(customer):
+    return StockReservation.objects.select_for_update().filter(
+        customer=customer, expires_at__gt=timezone.now())
+
+
+def take_stock(customer, quantities):
+    '''
+    Take {book id: quantity} out of stock for an order of `customer`,
+    using up the customer's live holds on those books first
+    '''
+    with transaction.atomic():
+        held = held_quantities(live_reservations(customer).filter(book_id__in=list(quantities)))
+        books = set(quantities) | set(held)
+        adjust_stock(dict((book_id, quantities.get(book_id, 0) - held.get(book_id, 0))
+                          for book_id in books))
+
+
+def release_stock(customer, book_ids=None):
+    ''' Return the live holds of `customer` (on `book_ids`) to stock '''
+    with transaction.atomic():
+        reservations = live_reservations(customer)
+        if book_ids is not None:
+            reservations = reservations.filter(book_id__in=list(book_ids))
+        held = held_quantities(reservations)
+        adjust_stock(dict((book_id, -qty) for book_id, qty in held.items()))
+
+
+def release_expired_reservations():
+    ''' Return every expired hold to stock; the number of books restocked '''
+    with transaction.atomic():
+        held = held_quantities(StockReservation.objects.select_for_update().filter(
+            expires_at__lte=timezone.now()))
+        adjust_stock(dict((book_id, -qty) for book_id, qty in held.items()))
+    return len(held)
@@ -1,4 +1,11 @@
 from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from catalog.fragments import cached_fragment
+from catalog.renditions import rendition_url, webp_supported
+from catalog.thumbnails import thumbnail_url
 
 register = template.Library()
 
@@ -13,4 +20,108 @@ def percent(value, arg):
         percentage = (value/arg)*100
     except ZeroDivisionError:
         percentage = 0
-    return percentage
\ No newline at end of file
+    return percentage
+
+
+@register.filter(name='facet_count')
+def facet_count(counts, value):
+    try:
+        return counts.get(int(value), 0)
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+@register.filter(name='stars')
+def stars(value, total=5):
+    '''
+    [True] * filled + [False] * empty stars of a rating rounded half up,
+    e.g. {% for full in book.avg_rating|stars %}
+    '''
+    try:
+        filled = int(float(value or 0) + 0.5)
+    except (TypeError, ValueError):
+        filled = 0
+    filled = max(0, min(filled, total))
+    return [True] * filled + [False] * (total - filled)
+
+
+class BookFragmentNode(template.Node):
+
+    def __init__(self, nodelist, book, name, vary_on):
+        self.nodelist = nodelist
+        self.book = book
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        book = self.book.resolve(context)
+        if book is None:
+            return self.nodelist.render(context)
+        vary_on = [value.resolve(context) for value in self.vary_on]
+        return mark_safe(cached_fragment(self.name.resolve(context), book,
+                                         lambda: self.nodelist.render(context), vary_on))
+
+
+@register.tag(name='bookcache')
+def do_bookcache(parser, token):
+    '''
+    Cache the enclosed markup per book and `last_modified`, see catalog.fragments:
+
+        {% bookcache book "card" [vary_on ...] %} ... {% endbookcache %}
+    '''
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError("'%s' takes a book and a fragment name" % bits[0])
+    nodelist = parser.parse(('endbookcache',))
+    parser.delete_first_token()
+    return BookFragmentNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]),
+                            [parser.compile_filter(bit) for bit in bits[3:]])
+
+
+@register.simple_tag(name='rendition')
+def rendition(image, size, fmt='jpeg'):
+    '''
+    URL of the `size` rendition of a book cover, {% rendition book.image "card" %}
+    '''
+    return rendition_url(image, size, fmt) or ''
+
+
+@register.simple_tag(name='cover')
+def cover(image, size, css_class=''):
+    '''
+    <picture> of the `size` rendition of a book cover offering the WebP
+    variant to browsers that take it, {% cover book.image "card" %}
+    '''
+    jpeg = rendition_url(image, size)
+    if not jpeg:
+        return ''
+    source = ''
+    webp = rendition_url(image, size, 'webp') if webp_supported() else None
+    if webp and webp != image.url:
+        source = format_html('<source type="image/webp" srcset="{}">', webp)
+    return format_html('<picture>{}<img src="{}" alt="" class="{}"></picture>', source, jpeg, css_class)
+
+
+@register.simple_tag(name='thumbnail')
+def thumbnail(image, width, height, fmt='jpeg'):
+    '''
+    URL of a book cover resized to width x height on first request,
+    {% thumbnail book.image 200 300 %}
+    '''
+    return thumbnail_url(image, width, height, fmt) or ''
+
+
+@register.simple_tag(name='thumbnail_img')
+def thumbnail_img(image, width, height, css_class=''):
+    '''
+    <picture> of a width x height cover thumbnail with a WebP source, or
+    the sample cover at that size when the book has none
+    '''
+    if not image:
+        return format_html('<img src="{}" alt="" width="{}" height="{}" class="{}">',
+                           static('assets/images/book-sample.jpg'), width, height, css_class)
+    source = ''
+    if webp_supported():
+        source = format_html('<source type="image/webp" srcset="{}">', thumbnail_url(image, width, height, 'webp'))
+    return format_html('<picture>{}<img src="{}" alt="" width="{}" height="{}" class="{}"></picture>',
+                       source, thumbnail_url(image, width, height), width, height, css_class)
@@ -1,3 +1,721 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from PIL import Image
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from accounts.models import User
+from bookstore.core.cache import MISSING, TwoTierCache, cache
+from bookstore.core.compression import UNRESOLVED, CompressionMiddleware, choose_encoding, compression_stats
+from bookstore.core.pagination import KeysetPagination
+from bookstore.core.storage import is_content_addressed
+from bookstore.core.testing import QueryBudgetMixin
+from catalog.filter_index import get_filter_index
+from catalog.models import Genre, Author, Publisher, Book, Order, OrderDetail, Review, CatalogVersion
+from catalog.orders import place_order
+from catalog.renditions import build_renditions, rendition_name, rendition_url, stored_url
+from catalog.search import VENDOR_BACKENDS, SimpleSearchBackend, get_search_backend
+from catalog.stock import OutOfStock, reserve_stock, release_expired_reservations
+from catalog.thumbnails import ThumbnailCache, thumbnail_cache, thumbnail_url
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_book(number, **fields):
+    defaults = {
+        'isbn': '97800000000%02d' % number, 'title': 'Book %d' % number, 'description': '',
+        'status': 'published', 'publication_date': datetime.date(2018, 1, 1),
+        'pages': 100, 'price': 100 * (number + 1),
+    }
+    if 'genre' not in fields:
+        defaults['genre'] = Genre.objects.get_or_create(name='Fiction')[0]
+    if 'publisher' not in fields:
+        defaults['publisher'] = Publisher.objects.get_or_create(name='Penguin')[0]
+    defaults.update(fields)
+    return Book.objects.create(**defaults)
+
+
+class RatingAggregateTest(TestCase):
+    '''
+    Review saves and deletes keep the book's rating aggregates with F() deltas
+    '''
+
+    def setUp(self):
+        self.book = create_book(1)
+        self.readers = [User.objects.create_user('reader%d@example.com' % number, 'secret')
+                        for number in range(3)]
+
+    def assertAggregates(self, rating_sum, rating_count, **stars):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_sum, self.book.rating_count), (rating_sum, rating_count))
+        for star in range(1, 6):
+            self.assertEqual(getattr(self.book, 'rating_%d' % star), stars.get('rating_%d' % star, 0))
+
+    def test_create_update_delete(self):
+        first = Review.objects.create(customer=self.readers[0], book=self.book, rating=4)
+        second = Review.objects.create(customer=self.readers[1], book=self.book, rating=2)
+        self.assertAggregates(6, 2, rating_4=1, rating_2=1)
+        first.rating = 5
+        first.save()
+        self.assertAggregates(7, 2, rating_5=1, rating_2=1)
+        # comment only edit
+        first.comment = 'Loved it'
+        first.save()
+        self.assertAggregates(7, 2, rating_5=1, rating_2=1)
+        second.delete()
+        self.assertAggregates(5, 1, rating_5=1)
+
+    def test_concurrent_review_survives_stale_book_save(self):
+        # an admin edits the book while a reader reviews it
+        stale = Book.objects.get(pk=self.book.pk)
+        Review.objects.create(customer=self.readers[0], book=self.book, rating=3)
+        stale.title = 'Edited'
+        stale.save()
+        self.assertAggregates(3, 1, rating_3=1)
+        self.assertEqual(self.book.title, 'Edited')
+
+    def test_reviews_loaded_separately(self):
+        Review.objects.create(customer=self.readers[0], book=self.book, rating=1)
+        Review.objects.create(customer=self.readers[1], book=self.book, rating=5)
+        # two requests holding their own copies of different reviews
+        first, second = [Review.objects.get(customer=reader) for reader in self.readers[:2]]
+        first.rating = 2
+        second.rating = 4
+        first.save()
+        second.save()
+        self.assertAggregates(6, 2, rating_2=1, rating_4=1)
+
+    def test_reconcile_fixes_drift(self):
+        Review.objects.create(customer=self.readers[0], book=self.book, rating=4)
+        Review.objects.create(customer=self.readers[1], book=self.book, rating=4)
+        Book.objects.filter(pk=self.book.pk).update(rating_sum=99, rating_count=7, rating_1=3, rating_4=0)
+        self.assertEqual(Book.reconcile_ratings(), 1)
+        self.assertAggregates(8, 2, rating_4=2)
+
+    def test_reconcile_command(self):
+        other = create_book(2)
+        Book.objects.filter(pk=other.pk).update(rating_sum=5, rating_count=1, rating_5=1)
+        call_command('reconcile_ratings', str(self.book.pk), stdout=io.StringIO())
+        other.refresh_from_db()
+        # only the named books are reconciled
+        self.assertEqual(other.rating_count, 1)
+        call_command('reconcile_ratings', stdout=io.StringIO())
+        other.refresh_from_db()
+        self.assertEqual((other.rating_sum, other.rating_count, other.rating_5), (0, 0, 0))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentReviewTest(TransactionTestCase):
+    '''
+    Reviews saved at the same time all reach the aggregates
+    '''
+    readers = 20
+
+    def test_simultaneous_reviews(self):
+        book = create_book(0)
+        readers = [User.objects.create_user('reviewer%d@example.com' % number, 'secret')
+                   for number in range(self.readers)]
+        start = threading.Barrier(self.readers)
+
+        def review(reader, rating):
+            try:
+                start.wait()
+                Review.objects.create(customer=reader, book=book, rating=rating)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=review, args=(reader, number % 5 + 1))
+                   for number, reader in enumerate(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(book.rating_count, self.readers)
+        self.assertEqual(book.rating_sum, sum(number % 5 + 1 for number in range(self.readers)))
+        self.assertEqual([getattr(book, 'rating_%d' % star) for star in range(1, 6)], [4] * 5)
+
+
+class KeysetPaginationTest(TestCase):
+    '''
+    Signed cursors page forward and backward through ties on the sort key
+    '''
+
+    class View(object):
+        keyset_ordering = ('title', 'id')
+
+    def setUp(self):
+        titles = ['Same', 'Zulu', 'Same', 'Alpha', 'Same']
+        books = [create_book(number, title=title) for number, title in enumerate(titles)]
+        self.expected = [book.id for book in sorted(books, key=lambda book: (book.title, book.id))]
+
+    def paginate(self, link=None):
+        ''' (book ids, paginator) of the page at `link`, the first page by default '''
+        params = {}
+        if link:
+            params = {'cursor': parse_qs(urlparse(link).query)['cursor'][0]}
+        paginator = KeysetPagination()
+        paginator.page_size = 2
+        request = Request(APIRequestFactory().get('/books/', params))
+        page = paginator.paginate_queryset(Book.objects.all(), request, self.View())
+        return [book.id for book in page], paginator
+
+    def test_forward_and_backward(self):
+        pages, paginator = [], None
+        link = None
+        while True:
+            ids, paginator = self.paginate(link)
+            pages.append(ids)
+            link = paginator.get_next_link()
+            if link is None:
+                break
+        self.assertEqual(pages, [self.expected[0:2], self.expected[2:4], self.expected[4:]])
+        ids, paginator = self.paginate(paginator.get_previous_link())
+        self.assertEqual(ids, self.expected[2:4])
+        ids, paginator = self.paginate(paginator.get_previous_link())
+        self.assertEqual(ids, self.expected[0:2])
+        self.assertIsNone(paginator.get_previous_link())
+        self.assertIsNotNone(paginator.get_next_link())
+
+    def test_tampered_cursor(self):
+        paginator = self.paginate()[1]
+        link = paginator.get_next_link()
+        cursor = parse_qs(urlparse(link).query)['cursor'][0]
+        with self.assertRaises(NotFound):
+            self.paginate('/books/?cursor=' + cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'))
+        # signed for another ordering
+        other = KeysetPagination()
+        other.ordering_fields = ('id',)
+        with self.assertRaises(NotFound):
+            self.paginate('/books/?cursor=' + other.encode_cursor([self.expected[1]], False))
+
+
+class SearchBackendTest(TestCase):
+    '''
+    Search backends rank title matches first and the index follows catalog edits
+    '''
+
+    def setUp(self):
+        self.author = Author.objects.create(name='Ursula Le Guin', description='')
+        self.book = create_book(1, title='The Dispossessed', description='An anarchist moon')
+        self.book.author.add(self.author)
+        self.other = create_book(2, title='Earthsea', description='Not the dispossessed')
+
+    def search(self, backend, text):
+        return list(backend.search(Book.objects.all(), text).values_list('id', flat=True))
+
+    def test_simple_backend(self):
+        backend = SimpleSearchBackend()
+        self.assertEqual(self.search(backend, 'dispossessed'), [self.book.id, self.other.id])
+        self.book.author.add(Author.objects.create(name='Le Guin Jr', description=''))
+        # one row per book however many of its authors match
+        self.assertEqual(self.search(backend, 'le guin'), [self.book.id])
+        self.assertEqual(self.search(backend, 'penguin'), [self.book.id, self.other.id])
+
+    @skipUnless(connection.vendor in VENDOR_BACKENDS, 'no full-text index for this database')
+    def test_index_follows_edits(self):
+        backend = get_search_backend()
+        self.assertEqual(self.search(backend, 'dispossessed')[0], self.book.id)
+        self.assertEqual(self.search(backend, 'guin'), [self.book.id])
+        self.author.name = 'Tolkien'
+        self.author.save()
+        self.assertEqual(self.search(backend, 'guin'), [])
+        self.assertEqual(self.search(backend, 'tolkien'), [self.book.id])
+        self.other.author.add(self.author)
+        self.assertCountEqual(self.search(backend, 'tolkien'), [self.book.id, self.other.id])
+        # cleared from the author side: the books are only known before the clear
+        self.author.book_set.clear()
+        self.assertEqual(self.search(backend, 'tolkien'), [])
+        self.book.delete()
+        self.assertEqual(self.search(backend, 'dispossessed'), [self.other.id])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApiQueryBudgetTest(QueryBudgetMixin, TestCase):
+    '''
+    Catalog API endpoints run a fixed number of queries, however many
+    books, authors and order lines a page holds
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader@example.com', 'secret')
+        authors = [Author.objects.create(name='Author %d' % number, description='')
+                   for number in range(3)]
+        cls.books = []
+        for number in range(6):
+            book = create_book(number)
+            book.author.add(*authors[number % 2:])
+            cls.books.append(book)
+        cls.genre = book.genre
+        cls.order = Order.objects.create(customer=cls.user, total_amt=600)
+        for book in cls.books:
+            OrderDetail.objects.create(order_id=cls.order, bk_id=book, qty=1, price=book.price)
+
+    def setUp(self):
+        cache.l1.clear()
+        get_filter_index().build()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertEndpointBudget(self, budget, name, **params):
+        with self.assertQueryBudget(budget):
+            response = self.client.get(reverse('catalogapi:%s' % name), params)
+        self.assertEqual(response.status_code, 200)
+
+    def test_book_list(self):
+        self.assertEndpointBudget(5, 'books-list', genre_id=self.genre.id)
+
+    def test_book_filters(self):
+        self.assertEndpointBudget(4, 'book-filters', genres=self.genre.name)
+
+    def test_book_detail(self):
+        self.assertEndpointBudget(3, 'book-detail', book_id=self.books[0].id)
+
+    def test_orders(self):
+        self.assertEndpointBudget(6, 'get-orders', customer=self.user.id)
+
+    def test_order_history(self):
+        self.assertEndpointBudget(2, 'order-history')
+        self.assertEndpointBudget(3, 'order-history', expand='book')
+
+    def test_sparse_fields(self):
+        with self.assertQueryBudget(2) as queries:
+            response = self.client.get(reverse('catalogapi:book-detail'),
+                                       {'book_id': self.books[0].id, 'fields': 'id,title,price'})
+        self.assertEqual(set(response.data), {'id', 'title', 'price'})
+        self.assertFalse(any('description' in query['sql'] for query in queries.captured_queries))
+
+    def test_unknown_sparse_fields_ignored(self):
+        url = reverse('catalogapi:book-detail')
+        response = self.client.get(url, {'book_id': self.books[0].id, 'fields': 'id,colour'})
+        self.assertEqual(set(response.data), {'id'})
+        response = self.client.get(url, {'book_id': self.books[0].id, 'fields': 'colour'})
+        self.assertIn('description', response.data)
+
+    def test_order_detail(self):
+        self.assertEndpointBudget(3, 'get-order-detail', order_id=self.order.id)
+
+
+class FilterIndexTest(TestCase):
+    '''
+    The filter index follows the catalog version and seeks small match sets by sorting them
+    '''
+
+    def setUp(self):
+        self.books = [create_book(number, title='Title %02d' % (10 - number)) for number in range(10)]
+        self.index = get_filter_index()
+        self.index.build()
+
+    def test_rebuilt_on_version_change(self):
+        self.assertFalse(self.index.is_stale())
+        # an edit made by another process: no signal reaches this index
+        CatalogVersion.objects.filter(id=1).update(version=F('version') + 1)
+        self.assertTrue(self.index.is_stale())
+        self.assertFalse(get_filter_index().is_stale())
+
+    def test_local_edit_applied_incrementally(self):
+        book = self.books[0]
+        book.title = 'Renamed'
+        with mock.patch.object(self.index, 'build') as build:
+            book.save()
+            self.assertFalse(self.index.is_stale())
+            self.assertIs(get_filter_index(), self.index)
+        build.assert_not_called()
+        self.assertEqual(self.index.books[book.id][0], 'Renamed')
+
+    def test_seek_small_match_set(self):
+        ids = array('I', sorted(book.id for book in self.books[2:5]))
+        expected = [book.id for book in sorted(self.books[2:5], key=lambda book: (book.title, book.id))]
+        position = (self.books[3].title, self.books[3].id)
+        self.addCleanup(delattr, self.index, 'sort_factor')
+        # 100: walk the title order, 2: sort the three matches
+        for factor in (100, 2):
+            self.index.sort_factor = factor
+            self.assertEqual(self.index.seek(ids, limit=10), expected)
+            self.assertEqual(self.index.seek(ids, position, limit=10), [self.books[2].id])
+            self.assertEqual(self.index.seek(ids, position, reverse=True, limit=10), [self.books[4].id])
+
+    def test_price_histogram_of_unknown_genre_is_empty(self):
+        self.assertEqual(sum(bucket['count'] for bucket in self.index.price_histogram()), 10)
+        genres = self.index.genre_ids(['No such genre'])
+        self.assertEqual(sum(bucket['count'] for bucket in self.index.price_histogram(genres)), 0)
+
+    def test_match_intersects_sorted_arrays(self):
+        genre = Genre.objects.create(name='Other genre')
+        moved = self.books[3:7]
+        for book in moved:
+            book.genre = genre
+            book.save()
+        # 450 falls inside a bucket: its prices are checked one by one
+        cheap = [book.id for book in self.books if book.price < 450]
+        self.assertEqual(list(self.index.match(genres=['Other genre'])), sorted(book.id for book in moved))
+        self.assertEqual(list(self.index.match(genres=['Other genre'], start=0, end=450)),
+                         sorted(book.id for book in moved if book.id in cheap))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TwoTierCacheTest(SimpleTestCase):
+    '''
+    get_or_compute computes a value once across workers and serves stale values while locked
+    '''
+
+    def setUp(self):
+        # two processes: separate L1 and local locks, one shared L2
+        self.cache = TwoTierCache()
+        self.other = TwoTierCache()
+        self.cache.backend.clear()
+
+    def test_concurrent_miss_computed_once(self):
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        def get(worker):
+            results.append(worker.get_or_compute('key', compute))
+
+        threads = [threading.Thread(target=get, args=(worker,))
+                   for worker in (self.cache, self.other) * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+    def test_stale_value_served_while_locked(self):
+        # soft expired already, still in L2 for CACHE_STALE_GRACE
+        self.cache.set('key', 'old', -1)
+        self.cache.backend.add('cache-lock:key', 1)
+        compute = mock.Mock(return_value='new')
+        self.assertEqual(self.other.get_or_compute('key', compute), 'old')
+        compute.assert_not_called()
+        self.cache.backend.delete('cache-lock:key')
+        self.assertEqual(self.other.get_or_compute('key', compute), 'new')
+        compute.assert_called_once_with()
+
+    def test_tag_invalidation(self):
+        self.cache.set('key', 'value', tags=('books',))
+        self.assertEqual(self.other.get('key'), 'value')
+        self.cache.invalidate_tags('books')
+        self.assertIs(self.cache.l1.get('key'), MISSING)
+        self.assertIsNone(self.cache.get('key'))
+        # the other process drops its L1 copy within CACHE_L1_TIMEOUT
+        self.other.l1.clear()
+        self.assertIsNone(self.other.get('key'))
+
+
+class CompressionMiddlewareTest(SimpleTestCase):
+    '''
+    Responses are compressed with the best accepted encoding unless small or already compressed
+    '''
+    body = b'{"title": "Book"}, ' * 200
+
+    def setUp(self):
+        self.middleware = CompressionMiddleware()
+        self.request = RequestFactory().get('/wp-login.php', HTTP_ACCEPT_ENCODING='gzip')
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(choose_encoding('br;q=0, gzip;q=0.5'), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0'))
+        self.assertIsNone(choose_encoding('identity'))
+        self.assertIsNone(choose_encoding(None))
+        self.assertIn(choose_encoding('*'), ('br', 'gzip'))
+
+    def test_compresses_and_weakens_etag(self):
+        response = HttpResponse(self.body, content_type='application/json')
+        response['ETag'] = '"abc"'
+        response = self.middleware.process_response(self.request, response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def test_small_and_compressed_types_skipped(self):
+        for response in (HttpResponse(b'{}', content_type='application/json'),
+                         HttpResponse(self.body, content_type='image/png')):
+            response = self.middleware.process_response(self.request, response)
+            self.assertFalse(response.has_header('Content-Encoding'))
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='identity')
+        response = self.middleware.process_response(request, HttpResponse(self.body))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_compressed_by_chunk(self):
+        chunks = [self.body[:1000], self.body[1000:]]
+        response = self.middleware.process_response(
+            self.request, StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
+
+    def test_unresolved_requests_share_one_entry(self):
+        self.middleware.process_response(self.request, HttpResponse(self.body))
+        report = compression_stats.report()
+        self.assertIn(UNRESOLVED, report)
+        self.assertNotIn('/wp-login.php', report)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTest(QueryBudgetMixin, TestCase):
+    '''
+    Unchanged catalog resources are answered with 304 from their validators alone
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader@example.com', 'secret')
+        cls.book = create_book(1)
+
+    def setUp(self):
+        cache.l1.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('catalogapi:book-detail')
+
+    def test_book_detail_not_modified(self):
+        response = self.client.get(self.url, {'book_id': self.book.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        with self.assertQueryBudget(1):
+            response = self.client.get(self.url, {'book_id': self.book.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_review_changes_book(self):
+        etag = self.client.get(self.url, {'book_id': self.book.id})['ETag']
+        Review.objects.create(customer=self.user, book=self.book, rating=4, comment='')
+        response = self.client.get(self.url, {'book_id': self.book.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_book_page_not_modified(self):
+        self.client.logout()
+        response = self.client.get(reverse('catalog:book-detail', kwargs={'Book_slug': self.book.slug}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response['Vary'])
+        response = self.client.get(reverse('catalog:book-detail', kwargs={'Book_slug': self.book.slug}),
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FragmentCacheTest(TestCase):
+    '''
+    Book fragments are rendered once per book version
+    '''
+
+    def setUp(self):
+        cache.l1.clear()
+        self.book = create_book(1)
+        self.template = Template('{% load mytags %}{% bookcache book "card" %}{{ book.title }} '
+                                 '{% for full in book.avg_rating|stars %}{{ full|yesno:"*,-" }}{% endfor %}'
+                                 '{% endbookcache %}')
+
+    def render(self):
+        return self.template.render(Context({'book': Book.objects.get(pk=self.book.pk)}))
+
+    def test_cached_until_book_changes(self):
+        self.assertEqual(self.render(), 'Book 1 -----')
+        Book.objects.filter(pk=self.book.pk).update(title='Renamed')
+        self.assertEqual(self.render(), 'Book 1 -----')
+        user = User.objects.create_user('reader@example.com', 'secret')
+        Review.objects.create(customer=user, book=self.book, rating=4, comment='')
+        self.assertEqual(self.render(), 'Renamed ****-')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MEDIA_ROOT=tempfile.mkdtemp(), CATALOG_IMAGE_WORKERS=0)
+class RenditionTest(TestCase):
+    '''
+    Covers are stored as uploaded and resized into every rendition
+    '''
+
+    def setUp(self):
+        cache.l1.clear()
+        output = io.BytesIO()
+        Image.new('RGB', (600, 800), 'red').save(output, format='PNG')
+        self.upload = output.getvalue()
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def test_original_kept(self):
+        book = create_book(1, image=SimpleUploadedFile('cover.png', self.upload))
+        with default_storage.open(book.image.name) as stored:
+            self.assertEqual(stored.read(), self.upload)
+        book.title = 'Edited'
+        book.save()
+        self.assertFalse(book._image_changed)
+
+    def test_identical_covers_stored_once(self):
+        first = create_book(1, image=SimpleUploadedFile('cover.png', self.upload))
+        second = create_book(2, image=SimpleUploadedFile('other.PNG', self.upload))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_content_addressed(first.image.name))
+        self.assertTrue(first.image.name.endswith('.png'))
+
+    def test_renditions(self):
+        book = create_book(1, image=SimpleUploadedFile('cover.png', self.upload))
+        build_renditions(book.id, book.image.name)
+        for size, box in settings.CATALOG_IMAGE_RENDITIONS.items():
+            name = rendition_name(book.image.name, size)
+            with default_storage.open(name) as stored:
+                self.assertEqual(Image.open(stored).size, box)
+            self.assertEqual(rendition_url(book.image, size), default_storage.url(name))
+
+    def test_missing_rendition_cached_until_built(self):
+        book = create_book(1, image=SimpleUploadedFile('cover.png', self.upload))
+        with mock.patch('catalog.renditions.stored_url', wraps=stored_url) as lookup:
+            self.assertEqual(rendition_url(book.image, 'card'), book.image.url)
+            self.assertEqual(rendition_url(book.image, 'card'), book.image.url)
+            self.assertEqual(lookup.call_count, 1)
+            build_renditions(book.id, book.image.name)
+            self.assertEqual(rendition_url(book.image, 'card'),
+                             default_storage.url(rendition_name(book.image.name, 'card')))
+
+    def test_thumbnail_view(self):
+        book = create_book(1, image=SimpleUploadedFile('cover.png', self.upload))
+        url = thumbnail_url(book.image, 50, 75)
+        with mock.patch.object(thumbnail_cache, 'root', settings.MEDIA_ROOT + '/thumbnails'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (50, 75))
+            response = self.client.get(url.replace('50x75', '500x750'))
+            self.assertEqual(response.status_code, 404)
+
+
+class ThumbnailCacheTest(SimpleTestCase):
+    '''
+    The thumbnail disk cache makes each file once and evicts the least recently used
+    '''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ThumbnailCache(self.root, 300, 5)
+        self.cache.touch_interval = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_concurrent_misses_generate_once(self):
+        calls = []
+
+        def generate():
+            calls.append(1)
+            time.sleep(0.2)
+            return b'x' * 10
+
+        threads = [threading.Thread(target=self.cache.get_or_create, args=('a.jpg', generate))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_least_recently_used_evicted(self):
+        paths = {}
+        for age, key in enumerate(('a.jpg', 'b.jpg', 'c.jpg')):
+            paths[key] = self.cache.get_or_create(key, lambda: b'x' * 100)[0]
+            os.utime(paths[key], (time.time() - 100 + age, time.time() - 100 + age))
+        # reading a makes b the least recently used
+        self.cache.get_or_create('a.jpg', lambda: b'')
+        self.cache.get_or_create('d.jpg', lambda: b'x' * 100)
+        self.assertFalse(os.path.exists(paths['b.jpg']))
+        self.assertTrue(os.path.exists(paths['a.jpg']))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockReservationTest(TestCase):
+    '''
+    Held stock is used up by the customer's order or returned on expiry
+    '''
+
+    def setUp(self):
+        self.customer = User.objects.create_user('reader@example.com', 'secret')
+        self.book = create_book(0, stock_qty=5, stock_free=False)
+
+    def assertStock(self, qty):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock_qty, qty)
+        self.assertEqual(self.book.stock_free, qty == 0)
+
+    def test_order_uses_hold(self):
+        reserve_stock(self.customer, {self.book.id: 5})
+        self.assertStock(0)
+        place_order(self.customer, [{'book': self.book.id, 'qty': 3}])
+        self.assertStock(2)
+
+    def test_expired_hold_is_released(self):
+        reserve_stock(self.customer, {self.book.id: 4}, timeout=0)
+        self.assertStock(1)
+        with self.assertRaises(OutOfStock):
+            place_order(self.customer, [{'book': self.book.id, 'qty': 2}])
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertStock(5)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+@override_settings(CACHES=LOCMEM_CACHES)
+class StockContentionTest(TransactionTestCase):
+    '''
+    Concurrent checkouts of one hot title sell exactly its stock
+    '''
+    buyers = 40
+    stock = 15
+
+    def test_hot_title(self):
+        book = create_book(0, stock_qty=self.stock, stock_free=False)
+        customers = [User.objects.create_user('buyer%d@example.com' % number, 'secret')
+                     for number in range(self.buyers)]
+        start = threading.Barrier(self.buyers)
+        sold = []
+
+        def checkout(customer):
+            try:
+                start.wait()
+                place_order(customer, [{'book': book.id, 'qty': 1, 'price': book.price}])
+                sold.append(customer.id)
+            except OutOfStock:
+                pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(len(sold), self.stock)
+        self.assertEqual(book.stock_qty, 0)
+        self.assertTrue(book.stock_free)
+        self.assertEqual(OrderDetail.objects.filter(bk_id=book).count(), self.stock)
@@ -0,0 +1,208 @@
+'''
+Book cover thumbnails of any size, made on first request.
+
+`thumbnail_url` points at a pre-built rendition when one of the asked
+size exists (see catalog.renditions) and otherwise at ThumbnailView,
+which resizes the cover on first access. URLs are signed so clients
+cannot make the server render arbitrary sizes.
+
+Thumbnails are kept in a disk cache bounded to THUMBNAIL_CACHE_MAX_SIZE
+bytes, evicting the least recently used files (a hit refreshes the
+file's mtime). Concurrent requests for a missing thumbnail wait for the
+one that makes it, within a process on a striped lock and across
+processes on a lock file next to the thumbnail.
+'''
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.urlresolvers import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image, ImageOps
+
+from catalog.renditions import FORMATS, encode, existing_rendition_url, open_cover
+
+# thumbnail file extension: format
+EXTENSIONS = dict((extension, fmt) for fmt, extension in FORMATS.items())
+
+
+class ThumbnailCache(object):
+    '''
+    Directory of generated files bounded in total size, least recently
+    used files evicted first
+    '''
+    # a hit refreshes the file's LRU position at most this often (seconds)
+    touch_interval = 60
+    # eviction goes down to this share of the maximum size
+    low_water = 0.9
+    poll_interval = 0.05
+    lock_stripes = 64
+
+    def __init__(self, root, max_size, lock_timeout):
+        self.root = root
+        self.max_size = max_size
+        self.lock_timeout = lock_timeout
+        # bytes stored, as far as this process knows
+        self.size = None
+        self.size_lock = threading.Lock()
+        self.evict_lock = threading.Lock()
+        self.local_locks = [threading.Lock() for _ in range(self.lock_stripes)]
+
+    def path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + os.path.splitext(key)[1])
+
+    def lookup(self, path):
+        ''' Size of the cached file at `path`, None when it is not cached '''
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.touch_interval:
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size
+
+    def get_or_create(self, key, generate):
+        '''
+        (path, size) of the cached file of `key`, storing the bytes
+        returned by `generate()` when it is missing
+        '''
+        path = self.path(key)
+        size = self.lookup(path)
+        if size is not None:
+            return path, size
+        with self.local_locks[zlib.crc32(key.encode('utf-8')) % self.lock_stripes]:
+            size = self.lookup(path)
+            if size is not None:
+                return path, size
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock_path = path + '.lock'
+            if self.acquire(lock_path):
+                try:
+                    return path, self.write(path, generate())
+                finally:
+                    os.remove(lock_path)
+            # another process is making it
+            deadline = time.time() + self.lock_timeout
+            while time.time() < deadline and os.path.exists(lock_path):
+                time.sleep(self.poll_interval)
+            size = self.lookup(path)
+            if size is not None:
+                return path, size
+            # the other process failed or timed out
+            return path, self.write(path, generate())
+
+    def acquire(self, lock_path):
+        for attempt in range(2):
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) < self.lock_timeout:
+                        return False
+                    # left behind by a crashed worker
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def write(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                output.write(data)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self.size_lock:
+            if self.size is None:
+                self.size = sum(size for mtime, size, name in self.files())
+            else:
+                self.size += len(data)
+            full = self.size > self.max_size
+        if full:
+            self.evict()
+        return len(data)
+
+    def files(self):
+        ''' (mtime, size, path) of every cached file '''
+        for directory, dirs, names in os.walk(self.root):
+            for name in names:
+                if name.startswith('.') or name.endswith('.lock'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        ''' Delete least recently used files until the cache is below its low water mark '''
+        if not self.evict_lock.acquire(False):
+            return
+        try:
+            files = sorted(self.files())
+            total = sum(size for mtime, size, path in files)
+            target = self.max_size * self.low_water
+            for mtime, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            with self.size_lock:
+                self.size = total
+        finally:
+            self.evict_lock.release()
+
+
+thumbnail_cache = ThumbnailCache(settings.THUMBNAIL_CACHE_DIR, settings.THUMBNAIL_CACHE_MAX_SIZE,
+                                 settings.CACHE_LOCK_TIMEOUT)
+
+
+def sign(name, width, height, extension):
+    value = '%dx%d.%s/%s' % (width, height, extension, name)
+    return signing.Signer(salt='catalog.thumbnails').signature(value)
+
+
+def valid_signature(signature, name, width, height, extension):
+    return constant_time_compare(signature, sign(name, width, height, extension))
+
+
+def thumbnail_url(image, width, height, fmt='jpeg'):
+    ''' URL of the `width` x `height` thumbnail of `image` (a stored cover) '''
+    if not image:
+        return None
+    width, height = int(width), int(height)
+    for size, box in settings.CATALOG_IMAGE_RENDITIONS.items():
+        if tuple(box) == (width, height):
+            url = existing_rendition_url(image.name, size, fmt)
+            if url:
+                return url
+    extension = FORMATS[fmt]
+    return reverse('catalog:thumbnail', kwargs={
+        'signature': sign(image.name, width, height, extension),
+        'width': width, 'height': height, 'extension': extension, 'name': image.name})
+
+
+def make_thumbnail(name, width, height, fmt):
+    ''' Encoded `width` x `height` thumbnail of the stored cover `name` '''
+    return encode(ImageOps.fit(open_cover(name), (width, height), Image.LANCZOS), fmt)
+
+
+def get_thumbnail(name, width, height, fmt):
+    ''' (path, size) of the cached thumbnail, made on the first call '''
+    key = '%s/%dx%d.%s' % (name, width, height, FORMATS[fmt])
+    return thumbnail_cache.get_or_create(key, lambda: make_thumbnail(name, width, height, fmt))
@@ -1,19 +1,40 @@
 from rest_framework import generics
 from django.views.generic import TemplateView
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAdminUser
 from drf_multiple_model.views import ObjectMultipleModelAPIView
 from rest_framework.pagination import PageNumberPagination
 from collections import OrderedDict
 from django.conf import settings
-from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from rest_framework import serializers
+from bookstore.core.cache import cache
+from bookstore.core.compression import compression_stats
+from bookstore.core.eager import EagerLoadingMixin, eager_load
+from bookstore.core.pagination import KeysetPagination
+from bookstore.core.streaming import StreamingExportMixin
 from bookstore.core.permissions import (PublicTokenAccessPermission,
                                        PrivateTokenAccessPermission,
                                        PublicPrivateTokenAccessPermission)
 from catalog.models import Genre, Book, Author, Publisher, Order, OrderDetail
+from catalog.autocomplete import complete
+from catalog.conditional import CatalogConditionalMixin, BookConditionalMixin
+from catalog.facets import book_facets
+from catalog.filter_index import get_filter_index
+from catalog.filters import parse_book_filters, filter_books
+from catalog.fuzzy import fuzzy_search
+from catalog.orders import cart_quantities
+from catalog.response_cache import CachedResponseMixin, response_cache_stats
+from catalog.search import search_books
+from catalog.stock import reserve_stock, release_stock
 from catalog.serializers import (CategoryListingSerializer, BooksListingSerializer,
                                  BookDetailSerializer, AuthorSerializer,
                                  PublisherSerializer,
-                                 OrdersViewSerializer, OrdersDetailViewSerializer)
+                                 OrdersViewSerializer, OrdersDetailViewSerializer,
+                                 OrderHistorySerializer, OrderHistoryDetailSerializer)
 
 class CategoryRecordsPagination(PageNumberPagination):
     ''' Record Pagination '''
@@ -26,7 +47,7 @@ class CategoryRecordsPagination(PageNumberPagination):
             ('results', data)
         ]))
 
-class GetCategories(generics.ListAPIView):
+class GetCategories(CatalogConditionalMixin, CachedResponseMixin, EagerLoadingMixin, generics.ListAPIView):
     '''
     Get all categories listing
     '''
@@ -36,97 +57,148 @@ class GetCategories(generics.ListAPIView):
         queryset = Genre.objects.filter().order_by('name')
         return queryset
 
-class GetBooks(generics.ListAPIView):
+class GetBooks(CatalogConditionalMixin, CachedResponseMixin, EagerLoadingMixin, generics.ListAPIView):
     '''
     Get all Books Listing
     '''
     serializer_class = BooksListingSerializer
-    pagination_class = CategoryRecordsPagination
+    pagination_class = KeysetPagination
+    keyset_ordering = ('title', 'id')
     permission_classes = (PrivateTokenAccessPermission, )
     def get_queryset(self):
         genre_id = self.request.query_params['genre_id']
         queryset = Book.objects.filter(genre=genre_id).order_by('title')
         return queryset
 
-class GetBookDetail(generics.RetrieveAPIView):
+class GetBookDetail(BookConditionalMixin, EagerLoadingMixin, generics.RetrieveAPIView):
     serializer_class = BookDetailSerializer
     permission_classes = (PrivateTokenAccessPermission, )
+    def get_book_queryset(self):
+        return Book.objects.filter(id=self.request.query_params['book_id'])
+
     def get_object(self):
         book_id = self.request.query_params['book_id']
-        queryset = Book.objects.filter(id=book_id).first()
+        queryset = self.filter_queryset(Book.objects.filter(id=book_id)).first()
         return queryset
 
-class BookSearch(generics.ListAPIView):
+class BookSearch(EagerLoadingMixin, generics.ListAPIView):
     serializer_class = BooksListingSerializer
-    pagination_class = CategoryRecordsPagination
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-search_rank', 'id')
     permission_classes = (PrivateTokenAccessPermission, )
     def get_queryset(self):
         genre_id = self.request.query_params['genre_id']
         search_text = self.request.query_params['search_text']
-        query = Q(title__icontains=search_text) | Q(author__name__icontains=search_text)
-        queryset = Book.objects.filter(genre=genre_id).filter(query)
+        if self.request.query_params.get('fuzzy') == '1':
+            queryset = fuzzy_search(Book.objects.filter(genre=genre_id), search_text)
+        else:
+            queryset = search_books(Book.objects.filter(genre=genre_id), search_text)
         return queryset
 
-class FilterList(ObjectMultipleModelAPIView):
-    querylist = (
-        {'queryset':Genre.objects.all(), 'serializer_class':CategoryListingSerializer},
-        {'queryset':Author.objects.all(), 'serializer_class':AuthorSerializer},
-        {'queryset':Publisher.objects.all(), 'serializer_class':PublisherSerializer},
-    )   
-    pagination_class = CategoryRecordsPagination
+class Autocomplete(APIView):
+    '''
+    Top title, author and publisher completions for the prefix `q`,
+    answered from the in-memory prefix index
+    '''
+    authentication_classes = ()
+    permission_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.query_params.get('q', '')
+        limit = request.query_params.get('limit')
+        try:
+            limit = max(1, min(int(limit), settings.CATALOG_AUTOCOMPLETE_MAX_LIMIT)) if limit else None
+        except ValueError:
+            limit = None
+        return Response({'results': complete(prefix, limit)})
+
+class FilterList(CachedResponseMixin, APIView):
+    '''
+    Genres, authors and publishers with the number of books each would
+    match given the other filters of the request (book-filters params),
+    and the price histogram of the selected genres
+    '''
     permission_classes = (PrivateTokenAccessPermission, )
 
-class BookFilter(generics.ListAPIView):
+    def get(self, request, *args, **kwargs):
+        filters = parse_book_filters(request.query_params)
+        index = get_filter_index(self.catalog_version)
+        facets = book_facets(lambda facet: filter_books(
+            Book.objects.all(), **dict(filters, **{facet + 's': None})))
+        return Response(OrderedDict([
+            ('Genre', facets['genre']),
+            ('Author', facets['author']),
+            ('Publisher', facets['publisher']),
+            ('Price', index.price_histogram(
+                index.genre_ids(filters['genres']) if filters['genres'] else None)),
+        ]))
+
+class BookFilter(CachedResponseMixin, EagerLoadingMixin, generics.ListAPIView):
     # queryset = Book.objects.all()
-    pagination_class = CategoryRecordsPagination
+    pagination_class = KeysetPagination
+    keyset_ordering = ('title', 'id')
     serializer_class = BooksListingSerializer
     permission_classes = (PrivateTokenAccessPermission, )
-    def get_filters(self, request):
-        genres = self.request.query_params.get('genres', None)
-        authors = self.request.query_params.get('authors', None)
-        publishers = self.request.query_params.get('publishers', None)
-        price_start = self.request.query_params.get('start', None)
-        price_end = self.request.query_params.get('end', None)
-        if price_start:
-            price_start = float(price_start)
-        if price_end:
-            price_end = float(price_end)
-        return genres, authors, publishers, price_start, price_end
-    def filter_by_authors(self, authors, data):
+    def get_queryset(self):
+        if settings.CATALOG_FILTER_INDEX:
+            # filtering happens in keyset_seek
+            return Book.objects.all()
+        filters = parse_book_filters(self.request.query_params)
+        return filter_books(Book.objects.all(), **filters)
+
+    def keyset_seek(self, queryset, position, reverse, limit):
         '''
-        Filter By author
+        Match and order the books in the in-memory filter index,
+        then fetch only the page rows
         '''
-        authors = authors.split(',')
-        return data.filter(author__name__in=authors)
+        if not settings.CATALOG_FILTER_INDEX:
+            return None
+        index = get_filter_index(self.catalog_version)
+        ids = index.seek(index.match(**parse_book_filters(self.request.query_params)),
+                         position, reverse, limit)
+        books = queryset.in_bulk(ids)
+        return [books[pk] for pk in ids if pk in books]
 
-    def filter_by_publishers(self, publishers, data):
-        publishers = publishers.split(',')
-        return data.filter(publisher__name__in=publishers)
+class BookExport(StreamingExportMixin, generics.GenericAPIView):
+    '''
+    Every book, streamed, for staff integrations; takes the same
+    fields parameter as the other book endpoints
+    '''
+    serializer_class = BookDetailSerializer
+    permission_classes = (IsAdminUser, )
 
-    def filter_by_genres(self, genres, data):
-        genres = genres.split(',')
-        return data.filter(genre__name__in=genres)
+    def get_queryset(self):
+        return Book.objects.all()
 
-    def filter_by_price_range(self, price_start, price_end, data):
-        '''
-        Filter By Price Range
-        '''
-        return data.filter(Q(price__lt=price_end) & Q(price__gte=price_start))
+class OrderExport(StreamingExportMixin, generics.GenericAPIView):
+    '''
+    Every order with its lines, streamed, for staff integrations
+    '''
+    serializer_class = OrdersViewSerializer
+    permission_classes = (IsAdminUser, )
 
     def get_queryset(self):
-        genres, authors, publishers, price_start, price_end = self.get_filters(self.request)
-        data = Book.objects.all()
-        if genres:
-            data = self.filter_by_genres(genres, data)
-        if authors:
-            data = self.filter_by_authors(authors, data)
-        if publishers:
-            data = self.filter_by_publishers(publishers, data)
-        if price_start != '' and price_start >= 0 and price_end != '':
-            data = self.filter_by_price_range(price_start, price_end, data)
-        return data
-
-class OrdersView(generics.ListCreateAPIView):
+        return Order.objects.all()
+
+class ResponseCacheStatsView(APIView):
+    '''
+    Hit rate and entry sizes of the catalog response cache in this process
+    '''
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request, *args, **kwargs):
+        return Response({'endpoints': response_cache_stats.report(), 'cache': cache.stats()})
+
+class CompressionStatsView(APIView):
+    '''
+    Compression ratio and CPU cost by endpoint and encoding in this process
+    '''
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request, *args, **kwargs):
+        return Response(compression_stats.report())
+
+class OrdersView(EagerLoadingMixin, generics.ListCreateAPIView):
     serializer_class = OrdersViewSerializer
     permission_classes = (PrivateTokenAccessPermission,)
 
@@ -135,7 +207,57 @@ class OrdersView(generics.ListCreateAPIView):
         queryset = Order.objects.filter(customer=customer)
         return queryset
 
-class OrdersDetailView(generics.ListAPIView):
+class OrderHistory(generics.ListAPIView):
+    '''
+    Orders of the signed in customer, newest first, with compact lines
+    (book id, title, qty, price). `expand=book` adds the book detail to
+    every line. Two queries per page, three when expanded.
+    '''
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-order_date', '-id')
+    permission_classes = (PrivateTokenAccessPermission,)
+
+    def expand_books(self):
+        return 'book' in self.request.query_params.get('expand', '').split(',')
+
+    def get_serializer_class(self):
+        if self.expand_books():
+            return OrderHistoryDetailSerializer
+        return OrderHistorySerializer
+
+    def get_queryset(self):
+        orders = Order.objects.filter(customer=self.request.user)
+        lines = self.get_serializer().fields.get('lines')
+        if lines is None:
+            return orders
+        return orders.prefetch_related(Prefetch('order_id', queryset=eager_load(
+            OrderDetail.objects.order_by('id'), lines.child, ('order_id',))))
+
+class StockReservationView(APIView):
+    '''
+    Hold stock for the signed in customer's checkout. POST `lines`
+    ([{book, qty}]) replaces the customer's holds, DELETE releases them.
+    '''
+    permission_classes = (PrivateTokenAccessPermission,)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            with transaction.atomic():
+                quantities = cart_quantities(request.data.get('lines') or [])
+                release_stock(request.user)
+                reservations = reserve_stock(request.user, quantities)
+        except ValidationError as error:
+            raise serializers.ValidationError(error.messages)
+        return Response({
+            'expires_at': reservations[0].expires_at,
+            'lines': [{'book': reservation.book_id, 'qty': reservation.qty} for reservation in reservations],
+        })
+
+    def delete(self, request, *args, **kwargs):
+        release_stock(request.user)
+        return Response({})
+
+class OrdersDetailView(EagerLoadingMixin, generics.ListAPIView):
     serializer_class = OrdersDetailViewSerializer
     permission_classes = (PrivateTokenAccessPermission,)
 
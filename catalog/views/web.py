@@ -4,65 +4,133 @@ import copy
 
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.core.urlresolvers import reverse_lazy, reverse
 from django.db.models import Min, Max
 from django.db.models import Q
 from django.views.generic import TemplateView, ListView, DetailView, FormView, CreateView
 from django.views import View
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ValidationError
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django_filters.views import FilterView
 
 from accounts.models import ContactUs, Address
+from bookstore.core.conditional import ConditionalGetMixin, PageCacheControlMixin
+from bookstore.core.sendfile import sendfile_response
+from bookstore.core.storage import is_content_addressed
+from catalog.conditional import book_validators
+from catalog.facets import facet_counts
+from catalog.filter_index import get_filter_index
 from catalog.filters import CatalogFilter
 from catalog.models import Book, Genre, Author, Publisher, OrderDetail, Order, Review
 from catalog.forms import CheckoutForm, TryForm
+from catalog.orders import place_order
+from catalog.reviews import ReviewSummary
+from catalog.fuzzy import fuzzy_search
+from catalog.renditions import webp_supported
+from catalog.search import search_books
+from catalog.thumbnails import EXTENSIONS, get_thumbnail, valid_signature
 from django.shortcuts import get_object_or_404
 
 def insert_order(self):
     data={}
-    user=self.request.user
-    total_amount = self.request.POST['total_amount']
-    order = Order.objects.create(customer=user, total_amt=total_amount)
     book_data = json.loads(self.request.POST.get('book_data'))
-    for book in book_data :
-        book_obj=Book.objects.get(pk=book['id'])
-        orderdetail = OrderDetail.objects.create(order_id=order, bk_id=book_obj, qty=book['quantity'], price=book['price'])
+    lines = [{'book': book['id'], 'qty': book['quantity'], 'price': book['price']} for book in book_data]
+    order = place_order(self.request.user, lines, self.request.POST['total_amount'])
     data['success'] = "Your Order has been Placed Successfully"
     data['target_url'] = reverse('catalog:order-detail',kwargs={'id':order.id})
     return data
 
-class HomeView(TemplateView):
+class HomeView(PageCacheControlMixin, TemplateView):
     template_name = 'layouts/index.html'
 
 
-class AboutView(TemplateView):
+class ShopView(PageCacheControlMixin, FilterView):
+    '''
+    Shop listing with facet counts for the filter sidebar
+    '''
+    filterset_class = CatalogFilter
+    template_name = 'layouts/shop.html'
+    # CatalogFilter parameter of each facet
+    facet_params = {'genre': 'genre_id', 'author': 'author', 'publisher': 'publisher_id'}
+
+    def get_context_data(self, **kwargs):
+        context = super(ShopView, self).get_context_data(**kwargs)
+
+        def queryset_without(facet):
+            params = self.request.GET.copy()
+            params.pop(self.facet_params[facet], None)
+            return self.filterset_class(params, queryset=Book.objects.all()).qs
+
+        context['facets'] = facet_counts(queryset_without)
+        genre_ids = [int(pk) for pk in self.request.GET.getlist('genre_id') if pk.isdigit()]
+        context['price_histogram'] = get_filter_index().price_histogram(genre_ids or None)
+        return context
+
+
+class AboutView(PageCacheControlMixin, TemplateView):
     template_name = 'layouts/about.html'
 
 
-class BookDetailView(TemplateView):
+class ThumbnailView(View):
+    '''
+    Book cover thumbnail of a signed size, made on first request and then
+    sent from the disk cache (see catalog.thumbnails)
+    '''
+
+    def get(self, request, signature, width, height, extension, name):
+        width, height = int(width), int(height)
+        fmt = EXTENSIONS.get(extension)
+        if (fmt is None or not valid_signature(signature, name, width, height, extension)
+                or not 0 < width <= settings.THUMBNAIL_MAX_DIMENSION
+                or not 0 < height <= settings.THUMBNAIL_MAX_DIMENSION
+                or (fmt == 'webp' and not webp_supported())):
+            raise Http404
+        for attempt in range(2):
+            try:
+                path, size = get_thumbnail(name, width, height, fmt)
+                response = sendfile_response(path, 'image/%s' % fmt, size)
+                break
+            except FileNotFoundError:
+                # the cover is gone, or the thumbnail was evicted in between
+                continue
+            except (IOError, OSError):
+                raise Http404
+        else:
+            raise Http404
+        # content addressed covers never change, neither do their thumbnails
+        max_age = settings.IMMUTABLE_MEDIA_MAX_AGE if is_content_addressed(name) else settings.THUMBNAIL_MAX_AGE
+        patch_cache_control(response, public=True, max_age=max_age, immutable=is_content_addressed(name))
+        return response
+
+
+class BookDetailView(ConditionalGetMixin, PageCacheControlMixin, TemplateView):
 
     template_name = 'layouts/single_product.html'
 
+    def get_validators(self):
+        books = Book.objects.filter(slug__iexact=self.kwargs['Book_slug'])
+        etag, last_modified = book_validators(books, prefix='page')
+        if etag is None:
+            return None, None
+        # the page shows the visitor's own review
+        return '%s-u%d' % (etag, self.request.user.pk or 0), last_modified
+
     def get_context_data(self, **kwargs):
         context = super(BookDetailView, self).get_context_data(**kwargs)
         context['book'] = get_object_or_404(
             Book, slug__iexact=self.kwargs['Book_slug'])
-        rating = Review.objects.filter(book=context['book']).order_by(
-            'id').select_related('customer')
-        rating_total = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 'total': 0}
-        for i in range(rating.count()):
-            rate = rating[i].rating
-            rating_total[rate] = rating_total[rate] + 1
-            rating_total['total'] = rating_total['total'] + 1
-            customer = rating[i].customer.email
-            if not self.request.user.is_anonymous() and self.request.user.email == customer:
-                context['userreview'] = rating[i]
-
-        context['ratings'] = rating
-        context['rating_total'] = rating_total
+        summary = ReviewSummary(context['book'], self.request.user)
+        try:
+            before = int(self.request.GET.get('before', 0))
+        except ValueError:
+            before = 0
+        context['ratings'], context['next_reviews'] = summary.page(before)
+        context['userreview'] = summary.user_review()
+        context['rating_total'] = summary.histogram()
         return context
 
     def post(self, request, *args, **kwargs):
@@ -191,27 +259,32 @@ class OrderDetailView(TemplateView):
         return context
 
 
-class FaqView(TemplateView):
+class FaqView(PageCacheControlMixin, TemplateView):
     template_name = 'layouts/faq.html'
 
 
-class SearchView(ListView):
+class SearchView(PageCacheControlMixin, ListView):
     '''
     Search View
     '''
     template_name = 'layouts/search.html'
+    context_object_name = 'book_list'
 
     def get_queryset(self):
         keywords = self.request.GET.get('q')
         if keywords:
-            queryset = Book.objects.filter(Q(title__icontains=keywords) | Q(description__icontains=keywords) | Q(
-                author__name__icontains=keywords) | Q(publisher__name__icontains=keywords) | Q(genre__name__icontains=keywords)).prefetch_related('author')
+            queryset = list(search_books(Book.objects.all(), keywords).prefetch_related('author'))
+            if len(queryset) < settings.CATALOG_FUZZY_MIN_HITS:
+                # few exact hits, probably a misspelling: add the closest titles and names
+                found = set(book.id for book in queryset)
+                queryset += [book for book in fuzzy_search(Book.objects.all(), keywords).prefetch_related('author')
+                             if book.id not in found]
             return queryset
         else:
-            queryset = 'No context'
+            queryset = Book.objects.none()
             return queryset
 
-class FaqView(TemplateView):
+class FaqView(PageCacheControlMixin, TemplateView):
     template_name = 'layouts/faq.html'
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -220,12 +293,11 @@ class PaymentCOD(CreateView):
     template_name = 'layouts/shop.html'
 
     def post(self, request, *args, **kwargs):
-        import pdb; pdb.set_trace()
         if self.request.is_ajax():
             try:
                 data = insert_order(self)
-            except ObjectDoesNotExist:
-                data['error'] = "There was a problem while placing your order"
+            except (ValueError, ValidationError):
+                data = {'error': "There was a problem while placing your order"}
             
             result=json.dumps(data)
 